@@ -35,7 +35,7 @@ class OzonProduct(models.Model):
     shop = models.ForeignKey(Shop, on_delete=models.CASCADE, related_name="products")
 
     product_id = models.BigIntegerField()
-    offer_id = models.CharField(max_length=255, db_index=True)
+    offer_id = models.CharField(max_length=255)
 
     archived = models.BooleanField(default=False)
     has_fbo_stocks = models.BooleanField(default=False)
@@ -51,6 +51,13 @@ class OzonProduct(models.Model):
     class Meta:
         db_table = "ozon_product"
         unique_together = ("shop", "product_id")  # уникален в рамках магазина
+        # выборки по товарам всегда в рамках магазина: составные индексы вместо полного скана
+        indexes = [
+            models.Index(fields=["shop", "offer_id"]),
+            models.Index(fields=["shop", "archived"]),
+            models.Index(fields=["shop", "has_fbo_stocks"]),
+            models.Index(fields=["shop", "has_fbs_stocks"]),
+        ]
 
     def __str__(self):
         return f"{self.shop_id}:{self.product_id} / {self.offer_id}"
\ No newline at end of file
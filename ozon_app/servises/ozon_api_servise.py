@@ -1,56 +1,105 @@
+from concurrent.futures import ThreadPoolExecutor
+from types import MappingProxyType
+from typing import Iterator
+
+import orjson
 import requests
-import json
+
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 
 class OzonAPIService:
+    # Максимальный размер страницы /v3/product/list по документации Ozon
+    PRODUCT_LIST_MAX_LIMIT = 1000
+
     def __init__(self, api_key: str, client_id: str, timeout: float = 15.0):
         self.api_key = api_key
         self.client_id = client_id
         self.base_url = "https://api-seller.ozon.ru"
         self.timeout = timeout
 
+        # одна сессия на сервис: keep-alive и пул соединений к api-seller.ozon.ru
+        self.session = requests.Session()
+        self.session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=4,
+                pool_maxsize=20,
+                max_retries=Retry(
+                    total=3,
+                    backoff_factor=1,
+                    status_forcelist=[429, 500, 502, 503, 504],
+                    allowed_methods=["POST"],
+                ),
+            ),
+        )
+        # заголовки неизменяемы: задаются один раз на сессию, а не на каждый запрос
+        self._headers = MappingProxyType(
+            {
+                "Client-Id": self.client_id,
+                "Api-Key": self.api_key,
+                "Content-Type": "application/json",
+            }
+        )
+        self.session.headers.update(self._headers)
+
+    def _fetch_product_page(self, filter: dict, last_id: str, limit: int) -> tuple[list, str]:
+        """Одна страница /v3/product/list: (товары, last_id следующей страницы)"""
+        try:
+            response = self.session.post(
+                f"{self.base_url}/v3/product/list",
+                data=orjson.dumps({"filter": filter, "last_id": last_id, "limit": limit}),
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            result = orjson.loads(response.content).get("result", {})
+        except requests.RequestException as e:
+            raise RuntimeError(f"Ошибка запроса к Ozon API: {e}") from e
+        except orjson.JSONDecodeError as e:
+            raise RuntimeError(f"Ошибка обработки JSON от Ozon API: {e}") from e
+
+        return result.get("items", []), result.get("last_id") or ""
+
+    def iter_product_pages(
+        self,
+        last_id: str = "",
+        limit: int = PRODUCT_LIST_MAX_LIMIT,
+        filter: dict | None = None,
+    ) -> Iterator[list]:
+        """
+        Постраничный обход списка товаров.
+        Следующая страница запрашивается в фоне, пока вызывающий код обрабатывает текущую.
+        """
+        if filter is None:
+            filter = {}
+        # больше максимума API не отдаст, а проверка "последней страницы" ниже сравнивает с limit
+        limit = min(limit, self.PRODUCT_LIST_MAX_LIMIT)
+
+        # курсор last_id известен только из предыдущего ответа, поэтому глубина предзагрузки — 1
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(self._fetch_product_page, filter, last_id, limit)
+            while future is not None:
+                products, last_id = future.result()
+                if len(products) < limit or not last_id:
+                    future = None
+                else:
+                    future = executor.submit(self._fetch_product_page, filter, last_id, limit)
+                yield products
+
     def get_all_products(
         self,
         all_products: list | None = None,
         last_id: str = "",
-        limit: int = 1000,
+        limit: int = PRODUCT_LIST_MAX_LIMIT,
         filter: dict | None = None,
     ) -> list:
         """Получение списка товаров с Ozon"""
 
         if all_products is None:
             all_products = []
-        if filter is None:
-            filter = {}
 
-        headers = {
-            "Client-Id": self.client_id,
-            "Api-Key": self.api_key,
-            "Content-Type": "application/json",
-        }
-
-        while True:
-            try:
-                response = requests.post(
-                    f"{self.base_url}/v3/product/list",
-                    headers=headers,
-                    json={"filter": filter, "last_id": last_id, "limit": limit},
-                    timeout=self.timeout,
-                )
-                response.raise_for_status()
-                result = response.json().get("result", {})
-            except requests.RequestException as e:
-                raise RuntimeError(f"Ошибка запроса к Ozon API: {e}") from e
-            except ValueError as e:
-                raise RuntimeError(f"Ошибка обработки JSON от Ozon API: {e}") from e
-
-            products = result.get("items", [])
+        for products in self.iter_product_pages(last_id=last_id, limit=limit, filter=filter):
             all_products.extend(products)
 
-            if len(products) < limit or not result.get("last_id"):
-                break
-
-            last_id = result["last_id"]
-
         return all_products
-
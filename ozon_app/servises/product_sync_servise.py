@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+import logging
+from typing import Optional
+
+from ..models import OzonProduct, Shop
+from .ozon_api_servise import OzonAPIService
+
+
+logger = logging.getLogger(__name__)
+
+
+class ProductSyncService:
+    """
+    Синхронизация списка товаров Ozon магазина в таблицу OzonProduct.
+    Страницы API сразу пишутся в БД (upsert по shop + product_id), весь каталог в памяти не копится.
+    """
+
+    # Поля, обновляемые у уже существующих товаров
+    UPDATE_FIELDS = (
+        "offer_id",
+        "archived",
+        "has_fbo_stocks",
+        "has_fbs_stocks",
+        "is_discounted",
+        "quants",
+        "data",
+        "updated_at",
+    )
+
+    def __init__(self, shop: Shop, api: Optional[OzonAPIService] = None, batch_size: int = 1000):
+        self.shop = shop
+        self.api = api or OzonAPIService(api_key=shop.ozon_api_key, client_id=shop.ozon_client_id)
+        self.batch_size = batch_size
+
+    def _to_model(self, item: dict) -> OzonProduct:
+        return OzonProduct(
+            shop=self.shop,
+            product_id=item["product_id"],
+            offer_id=item.get("offer_id", ""),
+            archived=bool(item.get("archived", False)),
+            has_fbo_stocks=bool(item.get("has_fbo_stocks", False)),
+            has_fbs_stocks=bool(item.get("has_fbs_stocks", False)),
+            is_discounted=bool(item.get("is_discounted", False)),
+            quants=item.get("quants") or [],
+            data=item,
+        )
+
+    def sync(self, filter: dict | None = None) -> int:
+        """Загрузить все страницы товаров и сохранить их. Возвращает число обработанных товаров."""
+        total = 0
+        # следующая страница запрашивается в фоне, пока текущая пишется в БД
+        for products in self.api.iter_product_pages(filter=filter):
+            objs = [self._to_model(p) for p in products if "product_id" in p]
+            if objs:
+                OzonProduct.objects.bulk_create(
+                    objs,
+                    batch_size=self.batch_size,
+                    update_conflicts=True,
+                    unique_fields=("shop", "product_id"),
+                    update_fields=self.UPDATE_FIELDS,
+                )
+            total += len(objs)
+            logger.info("Магазин %s: сохранено %s товаров (всего %s)", self.shop.pk, len(objs), total)
+        return total
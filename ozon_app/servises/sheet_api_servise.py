@@ -1,17 +1,50 @@
 from __future__ import annotations
 
 import logging
-import time
+import re
 from datetime import datetime
-from typing import Optional, Dict, List
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional, Dict, List
 
-import pandas as pd
-from googleapiclient.discovery import Resource
 from googleapiclient.errors import HttpError
 
+if TYPE_CHECKING:
+    # discovery тянет httplib2/uritemplate/google.auth; для аннотации импорт в рантайме не нужен
+    from googleapiclient.discovery import Resource
+
 
 logger = logging.getLogger(__name__)
 
+_A1_RANGE_RE = re.compile(r"^([A-Z]+)(\d*)(?::([A-Z]+)(\d*))?$")
+
+
+def _column_index(letters: str) -> int:
+    """Буквы столбца → 0-based индекс ('A' → 0, 'AA' → 26)."""
+    index = 0
+    for ch in letters:
+        index = index * 26 + (ord(ch) - ord("A") + 1)
+    return index - 1
+
+
+@lru_cache(maxsize=64)
+def _parse_a1(a1: str) -> tuple:
+    """
+    A1-диапазон без имени листа → (start_row_index, end_row or None, start_column_index, end_column_index).
+    Набор диапазонов у сервиса фиксированный, поэтому разбор кэшируется.
+    """
+    match = _A1_RANGE_RE.match(a1)
+    if not match:
+        raise ValueError(f"Некорректный A1-диапазон: {a1}")
+    start_col, start_row, end_col, end_row = match.groups()
+    if end_col is None:
+        end_col, end_row = start_col, start_row
+    return (
+        int(start_row) - 1 if start_row else 0,
+        int(end_row) if end_row else None,
+        _column_index(start_col),
+        _column_index(end_col) + 1,
+    )
+
 
 class SheetAPIService:
     """
@@ -19,147 +52,261 @@ class SheetAPIService:
     Ожидается, что `service` — это объект `build("sheets", "v4", credentials=creds)`.
     """
 
-    def __init__(self, service: Resource):
+    # Диапазоны (без имени листа), очищаемые перед записью товаров
+    CLEAR_RANGES = ("A5:ZZZ", "J4:M4", "AQ3:BR4", "BT3:CU4", "W3:AB3")
+
+    # Строк данных на один updateCells-запрос: тело batchUpdate остаётся в пределах
+    # лимита размера запроса Sheets, а ячейки в памяти строятся только для текущей порции
+    ROWS_PER_REQUEST = 20000
+
+    def __init__(self, service: Resource, num_retries: int = 5):
         self.service = service
+        # повторы на 429/5xx и обрывы соединения: экспоненциальная пауза с джиттером внутри googleapiclient
+        self.num_retries = num_retries
+        # sheetId листа не меняется в течение жизни сервиса: (spreadsheet_id, sheet_name) → sheetId
+        self._sheet_ids: Dict[tuple, int] = {}
+        # свойства листа (размеры сетки) — до первого batchUpdate по этой книге
+        self._meta_cache: Dict[tuple, dict] = {}
 
     # ---------- ВСПОМОГАТЕЛЬНЫЕ МЕТОДЫ ----------
 
-    def _get_sheet_metadata(self, spreadsheet_id: str, fields: str) -> dict:
+    def _execute(self, request):
+        """Выполнить запрос API с повторами (HttpError пробрасывается после исчерпания попыток)."""
+        return request.execute(num_retries=self.num_retries)
+
+    def _get_sheet_metadata(
+        self, spreadsheet_id: str, fields: str, ranges: Optional[List[str]] = None
+    ) -> dict:
+        params = {"spreadsheetId": spreadsheet_id, "fields": fields}
+        if ranges:
+            params.update(ranges=ranges, includeGridData=True)
         try:
-            return (
-                self.service.spreadsheets()
-                .get(spreadsheetId=spreadsheet_id, fields=fields)
-                .execute()
-            )
+            return self._execute(self.service.spreadsheets().get(**params))
         except HttpError as e:
             raise RuntimeError(f"Ошибка получения метаданных книги: {e}") from e
 
-    def _find_sheet(self, spreadsheet_id: str, sheet_name: str) -> Optional[dict]:
-        meta = self._get_sheet_metadata(
-            spreadsheet_id,
-            fields="sheets(properties(sheetId,title,gridProperties(rowCount,columnCount)))",
-        )
-        return next(
+    def _find_sheet(
+        self, spreadsheet_id: str, sheet_name: str, need_values_range: Optional[str] = None
+    ) -> Optional[dict]:
+        """
+        Свойства листа по названию. С `need_values_range` (A1 без имени листа) тем же запросом
+        приходят и значения диапазона — в `sheet["data"][0]["rowData"]`.
+        """
+        key = (spreadsheet_id, sheet_name)
+        if not need_values_range and key in self._meta_cache:
+            return self._meta_cache[key]
+
+        fields = "sheets(properties(sheetId,title,gridProperties(rowCount,columnCount)))"
+        ranges = None
+        if need_values_range:
+            fields = (
+                "sheets(properties(sheetId,title,gridProperties(rowCount,columnCount)),"
+                "data(rowData(values(effectiveValue))))"
+            )
+            ranges = [f"{sheet_name}!{need_values_range}"]
+        meta = self._get_sheet_metadata(spreadsheet_id, fields=fields, ranges=ranges)
+        sheet = next(
             (s for s in meta.get("sheets", []) if s["properties"]["title"] == sheet_name),
             None,
         )
-
-    def _get_sheet_id(self, spreadsheet_id: str, sheet_name: str) -> int:
-        sheet = self._find_sheet(spreadsheet_id, sheet_name)
+        if sheet and not need_values_range:
+            self._meta_cache[key] = sheet
+        return sheet
+
+    def _invalidate_metadata(self, spreadsheet_id: str) -> None:
+        """Сбросить закэшированные свойства листов книги (после изменения размеров/структуры)."""
+        for key in [k for k in self._meta_cache if k[0] == spreadsheet_id]:
+            del self._meta_cache[key]
+
+    def _require_sheet(
+        self, spreadsheet_id: str, sheet_name: str, sheet: Optional[dict] = None
+    ) -> dict:
+        """Вернуть уже полученные свойства листа или запросить их один раз."""
+        if sheet is None:
+            sheet = self._find_sheet(spreadsheet_id, sheet_name)
         if not sheet:
             raise RuntimeError(f"Лист '{sheet_name}' не найден.")
-        return sheet["properties"]["sheetId"]
+        return sheet
 
-    # ---------- ОПЕРАЦИИ С ФИЛЬТРОМ ----------
-
-    def remove_filter(self, spreadsheet_id: str, sheet_name: str) -> dict:
-        """Удалить basic filter с листа."""
-        sheet_id = self._get_sheet_id(spreadsheet_id, sheet_name)
-        requests = [{"clearBasicFilter": {"sheetId": sheet_id}}]
+    def _get_sheet_id(self, spreadsheet_id: str, sheet_name: str) -> int:
+        key = (spreadsheet_id, sheet_name)
+        if key not in self._sheet_ids:
+            self._sheet_ids[key] = self._require_sheet(spreadsheet_id, sheet_name)["properties"]["sheetId"]
+        return self._sheet_ids[key]
+
+    def _batch_update(self, spreadsheet_id: str, requests: List[dict], error_message: str) -> dict:
+        """Выполнить список запросов одним spreadsheets.batchUpdate (атомарно, по порядку)."""
+        # batchUpdate может менять число строк/столбцов — кэш свойств листов больше не актуален
+        self._invalidate_metadata(spreadsheet_id)
         try:
-            resp = (
-                self.service.spreadsheets()
-                .batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests})
-                .execute()
+            return self._execute(
+                self.service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests})
             )
-            logger.info("✅ Фильтр удалён с листа '%s'", sheet_name)
-            return resp
         except HttpError as e:
-            raise RuntimeError(f"Ошибка при удалении фильтра: {e}") from e
+            raise RuntimeError(f"{error_message}: {e}") from e
 
-    def add_full_range_filter(self, spreadsheet_id: str, sheet_name: str, start_row: int = 4) -> dict:
+    # ---------- ПОСТРОИТЕЛИ ЗАПРОСОВ batchUpdate ----------
+
+    @staticmethod
+    def _grid_range(sheet: dict, a1: str) -> Optional[dict]:
         """
-        Добавить basic filter на ВСЕ столбцы, начиная с `start_row` (1-based) и до последней заполненной строки.
+        A1-диапазон без имени листа ('J4:M4', 'A5:ZZZ') → GridRange, обрезанный по текущей сетке листа.
+        Возвращает None, если диапазон целиком за пределами сетки.
         """
-        sheet = self._find_sheet(spreadsheet_id, sheet_name)
-        if not sheet:
-            raise RuntimeError(f"Лист '{sheet_name}' не найден.")
-        sheet_id = sheet["properties"]["sheetId"]
-        end_column_index = sheet["properties"]["gridProperties"]["columnCount"]
+        start_row_index, end_row, start_column_index, end_column_index = _parse_a1(a1)
+        grid = sheet["properties"]["gridProperties"]
+        end_row_index = min(end_row, grid["rowCount"]) if end_row else grid["rowCount"]
+        end_column_index = min(end_column_index, grid["columnCount"])
+        if start_row_index >= end_row_index or start_column_index >= end_column_index:
+            return None
+
+        return {
+            "sheetId": sheet["properties"]["sheetId"],
+            "startRowIndex": start_row_index,
+            "endRowIndex": end_row_index,
+            "startColumnIndex": start_column_index,
+            "endColumnIndex": end_column_index,
+        }
 
-        # определяем последнюю занятую строку по столбцу A
-        try:
-            values = (
-                self.service.spreadsheets()
-                .values()
-                .get(
-                    spreadsheetId=spreadsheet_id,
-                    range=f"{sheet_name}!A:A",
-                    majorDimension="COLUMNS",
-                )
-                .execute()
-                .get("values", [[]])
-            )
-        except HttpError as e:
-            raise RuntimeError(f"Ошибка чтения данных для фильтра: {e}") from e
-
-        last_row = len(values[0]) if values and values[0] else start_row
-        end_row_index = max(last_row, start_row)  # защита от инверсии
-
-        requests = [
-            {
-                "setBasicFilter": {
-                    "filter": {
-                        "range": {
-                            "sheetId": sheet_id,
-                            "startRowIndex": start_row - 1,  # 0-based
-                            "endRowIndex": end_row_index,     # 0-based exclusive
-                            "startColumnIndex": 0,
-                            "endColumnIndex": end_column_index,
-                        },
-                        "sortSpecs": [],
-                        "filterSpecs": [],
-                    }
+    @staticmethod
+    def _filter_request(sheet_id: int, start_row: int, end_row_index: int, end_column_index: int) -> dict:
+        return {
+            "setBasicFilter": {
+                "filter": {
+                    "range": {
+                        "sheetId": sheet_id,
+                        "startRowIndex": start_row - 1,  # 0-based
+                        "endRowIndex": end_row_index,     # 0-based exclusive
+                        "startColumnIndex": 0,
+                        "endColumnIndex": end_column_index,
+                    },
+                    "sortSpecs": [],
+                    "filterSpecs": [],
                 }
             }
-        ]
+        }
 
-        try:
-            resp = (
-                self.service.spreadsheets()
-                .batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests})
-                .execute()
+    @staticmethod
+    def _append_rows_request(sheet_id: int, length: int) -> dict:
+        return {"appendDimension": {"sheetId": sheet_id, "dimension": "ROWS", "length": length}}
+
+    @staticmethod
+    def _delete_rows_request(sheet_id: int, start_index: int, end_index: int) -> dict:
+        return {
+            "deleteDimension": {
+                "range": {
+                    "sheetId": sheet_id,
+                    "dimension": "ROWS",
+                    "startIndex": start_index,  # 0-based inclusive
+                    "endIndex": end_index,      # 0-based exclusive
+                }
+            }
+        }
+
+    def _clear_requests(self, sheet: dict) -> List[dict]:
+        """updateCells без `rows` по каждому из CLEAR_RANGES: значения в диапазоне стираются."""
+        requests = []
+        for a1 in self.CLEAR_RANGES:
+            grid_range = self._grid_range(sheet, a1)
+            if grid_range:
+                requests.append({"updateCells": {"range": grid_range, "fields": "userEnteredValue"}})
+        return requests
+
+    @staticmethod
+    def _cell_data(value) -> dict:
+        """Значение ячейки для updateCells (аналог valueInputOption=RAW)."""
+        if value is None or value == "":
+            return {}
+        if isinstance(value, bool):
+            return {"userEnteredValue": {"boolValue": value}}
+        if isinstance(value, (int, float)):
+            return {"userEnteredValue": {"numberValue": value}}
+        return {"userEnteredValue": {"stringValue": str(value)}}
+
+    def _rows_request(self, sheet_id: int, values: List[list], start_row: int) -> dict:
+        """Запись строк `values`, начиная с `start_row` (1-based) и столбца A."""
+        return {
+            "updateCells": {
+                "start": {"sheetId": sheet_id, "rowIndex": start_row - 1, "columnIndex": 0},
+                "rows": [{"values": [self._cell_data(v) for v in row]} for row in values],
+                "fields": "userEnteredValue",
+            }
+        }
+
+    # ---------- ОПЕРАЦИИ С ФИЛЬТРОМ ----------
+
+    def remove_filter(self, spreadsheet_id: str, sheet_name: str) -> dict:
+        """Удалить basic filter с листа."""
+        sheet_id = self._get_sheet_id(spreadsheet_id, sheet_name)
+        resp = self._batch_update(
+            spreadsheet_id, [{"clearBasicFilter": {"sheetId": sheet_id}}], "Ошибка при удалении фильтра"
+        )
+        logger.info("✅ Фильтр удалён с листа '%s'", sheet_name)
+        return resp
+
+    def add_full_range_filter(
+        self,
+        spreadsheet_id: str,
+        sheet_name: str,
+        end_row_index: Optional[int] = None,
+        start_row: int = 4,
+        sheet: Optional[dict] = None,
+    ) -> dict:
+        """
+        Добавить basic filter на ВСЕ столбцы, начиная с `start_row` (1-based) и до строки `end_row_index`.
+
+        Обычно `end_row_index` известен вызывающему коду (число записанных строк + заголовок).
+        Если нет — последняя занятая строка по столбцу A приходит тем же запросом метаданных листа.
+        Уже полученные свойства листа можно передать в `sheet`, чтобы не запрашивать их повторно.
+        """
+        if end_row_index is None:
+            sheet = self._require_sheet(
+                spreadsheet_id, sheet_name, self._find_sheet(spreadsheet_id, sheet_name, need_values_range="A:A")
             )
-            logger.info("✅ Фильтр добавлен на '%s' (строки %s-%s)", sheet_name, start_row, end_row_index)
-            return resp
-        except HttpError as e:
-            raise RuntimeError(f"Ошибка при добавлении фильтра: {e}") from e
+            row_data = (sheet.get("data") or [{}])[0].get("rowData", [])
+            end_row_index = len(row_data) or start_row
+        else:
+            sheet = self._require_sheet(spreadsheet_id, sheet_name, sheet)
+        sheet_id = sheet["properties"]["sheetId"]
+        end_column_index = sheet["properties"]["gridProperties"]["columnCount"]
+        end_row_index = max(end_row_index, start_row)  # защита от инверсии
+
+        resp = self._batch_update(
+            spreadsheet_id,
+            [self._filter_request(sheet_id, start_row, end_row_index, end_column_index)],
+            "Ошибка при добавлении фильтра",
+        )
+        logger.info("✅ Фильтр добавлен на '%s' (строки %s-%s)", sheet_name, start_row, end_row_index)
+        return resp
 
     # ---------- ОЧИСТКА ДИАПАЗОНОВ / РАЗМЕР ЛИСТА ----------
 
-    def clear_google_sheet_range(self, spreadsheet_id: str, sheet_name: str) -> dict:
+    def clear_google_sheet_range(
+        self, spreadsheet_id: str, sheet_name: str, sheet: Optional[dict] = None
+    ) -> dict:
         """
         Очистка фиксированных диапазонов:
         - все данные с 5 строки
         - вспомогательные блоки J4:M4, AQ3:BR4, BT3:CU4, W3:AB3
+        Все диапазоны очищаются одним batchUpdate (updateCells без значений).
         """
-        clear_ranges = [
-            f"{sheet_name}!A5:ZZZ",
-            f"{sheet_name}!J4:M4",
-            f"{sheet_name}!AQ3:BR4",
-            f"{sheet_name}!BT3:CU4",
-            f"{sheet_name}!W3:AB3",
-        ]
-        try:
-            resp = (
-                self.service.spreadsheets()
-                .values()
-                .batchClear(spreadsheetId=spreadsheet_id, body={"ranges": clear_ranges})
-                .execute()
-            )
-            logger.info("✅ Указанные диапазоны очищены")
-            return resp
-        except HttpError as e:
-            raise RuntimeError(f"Ошибка при очистке диапазонов: {e}") from e
-
-    def adjust_sheet_size(self, spreadsheet_id: str, sheet_name: str, required_rows: int) -> None:
+        sheet = self._require_sheet(spreadsheet_id, sheet_name, sheet)
+        requests = self._clear_requests(sheet)
+        if not requests:
+            logger.info("✅ Диапазоны для очистки за пределами листа")
+            return {}
+        resp = self._batch_update(spreadsheet_id, requests, "Ошибка при очистке диапазонов")
+        logger.info("✅ Указанные диапазоны очищены")
+        return resp
+
+    def adjust_sheet_size(
+        self, spreadsheet_id: str, sheet_name: str, required_rows: int, sheet: Optional[dict] = None
+    ) -> None:
         """
         Увеличивает число строк до required_rows + 4 (запас под шапку),
         если текущих строк меньше.
         """
-        sheet = self._find_sheet(spreadsheet_id, sheet_name)
-        if not sheet:
-            raise RuntimeError(f"Лист '{sheet_name}' не найден.")
+        sheet = self._require_sheet(spreadsheet_id, sheet_name, sheet)
         sheet_id = sheet["properties"]["sheetId"]
         current_rows = sheet["properties"]["gridProperties"]["rowCount"]
         target_rows = required_rows + 4
@@ -168,26 +315,20 @@ class SheetAPIService:
             return
 
         append_len = target_rows - current_rows
-        request = {
-            "appendDimension": {"sheetId": sheet_id, "dimension": "ROWS", "length": append_len}
-        }
-        try:
-            self.service.spreadsheets().batchUpdate(
-                spreadsheetId=spreadsheet_id, body={"requests": [request]}
-            ).execute()
-            logger.info("Добавлено %s строк на лист '%s'.", append_len, sheet_name)
-        except HttpError as e:
-            raise RuntimeError(f"Ошибка увеличения числа строк: {e}") from e
+        self._batch_update(
+            spreadsheet_id,
+            [self._append_rows_request(sheet_id, append_len)],
+            "Ошибка увеличения числа строк",
+        )
+        logger.info("Добавлено %s строк на лист '%s'.", append_len, sheet_name)
 
     def remove_empty_rows_after_data(
-        self, spreadsheet_id: str, sheet_name: str, data_row_count: int
+        self, spreadsheet_id: str, sheet_name: str, data_row_count: int, sheet: Optional[dict] = None
     ) -> None:
         """
         Удаляет пустые строки после данных, начиная с (data_row_count + 5)-й строки (1-based).
         """
-        sheet = self._find_sheet(spreadsheet_id, sheet_name)
-        if not sheet:
-            raise RuntimeError(f"Лист '{sheet_name}' не найден.")
+        sheet = self._require_sheet(spreadsheet_id, sheet_name, sheet)
         sheet_id = sheet["properties"]["sheetId"]
         total_rows = sheet["properties"]["gridProperties"]["rowCount"]
 
@@ -196,25 +337,13 @@ class SheetAPIService:
             logger.info("✅ Пустых строк для удаления нет")
             return
 
-        request = {
-            "deleteDimension": {
-                "range": {
-                    "sheetId": sheet_id,
-                    "dimension": "ROWS",
-                    "startIndex": start_delete_row - 1,  # 0-based inclusive
-                    "endIndex": total_rows,              # 0-based exclusive
-                }
-            }
-        }
-
-        try:
-            self.service.spreadsheets().batchUpdate(
-                spreadsheetId=spreadsheet_id, body={"requests": [request]}
-            ).execute()
-            deleted = total_rows - (start_delete_row - 1)
-            logger.info("✅ Удалено %s пустых строк (с %s по %s).", deleted, start_delete_row, total_rows)
-        except HttpError as e:
-            raise RuntimeError(f"Ошибка удаления пустых строк: {e}") from e
+        self._batch_update(
+            spreadsheet_id,
+            [self._delete_rows_request(sheet_id, start_delete_row - 1, total_rows)],
+            "Ошибка удаления пустых строк",
+        )
+        deleted = total_rows - (start_delete_row - 1)
+        logger.info("✅ Удалено %s пустых строк (с %s по %s).", deleted, start_delete_row, total_rows)
 
     def clear_excess_rows(
         self, spreadsheet_id: str, sheet_name: str, required_rows: int
@@ -223,9 +352,11 @@ class SheetAPIService:
         clear_from = required_rows + 5
         clear_range = f"{sheet_name}!A{clear_from}:ZZZ"
         try:
-            self.service.spreadsheets().values().clear(
-                spreadsheetId=spreadsheet_id, range=clear_range, body={}
-            ).execute()
+            self._execute(
+                self.service.spreadsheets().values().clear(
+                    spreadsheetId=spreadsheet_id, range=clear_range, body={}
+                )
+            )
             logger.info("✅ Очищены строки после %s-й строки", required_rows + 4)
         except HttpError as e:
             raise RuntimeError(f"Ошибка очистки лишних строк: {e}") from e
@@ -237,57 +368,50 @@ class SheetAPIService:
         products: List[Dict],
         spreadsheet_id: str,
         sheet_name: str,
-        delay_before_filter_sec: float = 0.0,
     ) -> None:
         """
         Сохраняет товары (product_id, offer_id) в лист, настраивает размеры,
         чистит диапазоны и ставит фильтр.
         """
-        # нормализуем данные → только нужные поля
-        rows = [
-            {"product_id": p["product_id"], "offer_id": p["offer_id"]}
+        # нормализуем данные → строки A:D (product_id, пустые B и C, offer_id)
+        values = [
+            [p["product_id"], "", "", p["offer_id"]]
             for p in products
             if isinstance(p, dict) and "product_id" in p and "offer_id" in p
         ]
-        df = pd.DataFrame(rows, columns=["product_id", "offer_id"])
-        # вставляем 2 пустых столбца B и C
-        df.insert(1, "Empty_B", "")
-        df.insert(2, "Empty_C", "")
-
-        values = df.values.tolist()
         data_row_count = len(values)
         logger.info("К записи подготовлено %s строк.", data_row_count)
 
-        # 1) снять фильтр, 2) очистить диапазоны
-        self.remove_filter(spreadsheet_id, sheet_name)
-        self.clear_google_sheet_range(spreadsheet_id, sheet_name)
-
-        # 3) записать данные с A5
-        try:
-            self.service.spreadsheets().values().update(
-                spreadsheetId=spreadsheet_id,
-                range=f"{sheet_name}!A5",
-                valueInputOption="RAW",
-                body={"values": values},
-            ).execute()
-        except HttpError as e:
-            raise RuntimeError(f"Ошибка записи данных: {e}") from e
-
-        # 4) подогнать число строк
-        self.adjust_sheet_size(spreadsheet_id, sheet_name, data_row_count)
-
-        # 5) очистить лишнее ниже данных (без удаления строк)
-        self.clear_excess_rows(spreadsheet_id, sheet_name, data_row_count)
-
-        # 6) удалить полностью пустые строки после данных (физически)
-        self.remove_empty_rows_after_data(spreadsheet_id, sheet_name, data_row_count)
-
-        # 7) необязательная пауза
-        if delay_before_filter_sec > 0:
-            time.sleep(delay_before_filter_sec)
-
-        # 8) снова поставить фильтр
-        self.add_full_range_filter(spreadsheet_id, sheet_name)
+        sheet = self._require_sheet(spreadsheet_id, sheet_name)
+        sheet_id = sheet["properties"]["sheetId"]
+        grid = sheet["properties"]["gridProperties"]
+        current_rows = grid["rowCount"]
+        target_rows = data_row_count + 4  # 4 строки шапки
+
+        # Все шаги — один batchUpdate: снять фильтр, подогнать число строк,
+        # очистить диапазоны, записать данные с A5, удалить лишние строки, поставить фильтр.
+        # Если строк больше ROWS_PER_REQUEST, остальные порции данных уходят следующими batchUpdate
+        chunk = self.ROWS_PER_REQUEST
+        requests = [{"clearBasicFilter": {"sheetId": sheet_id}}]
+        if current_rows < target_rows:
+            requests.append(self._append_rows_request(sheet_id, target_rows - current_rows))
+        requests.extend(self._clear_requests(sheet))
+        if values:
+            requests.append(self._rows_request(sheet_id, values[:chunk], start_row=5))
+        if current_rows > target_rows:
+            requests.append(self._delete_rows_request(sheet_id, target_rows, current_rows))
+
+        requests.append(self._filter_request(sheet_id, 4, target_rows, grid["columnCount"]))
+        self._batch_update(spreadsheet_id, requests, "Ошибка записи товаров")
+
+        for offset in range(chunk, data_row_count, chunk):
+            self._batch_update(
+                spreadsheet_id,
+                [self._rows_request(sheet_id, values[offset : offset + chunk], start_row=5 + offset)],
+                "Ошибка записи товаров",
+            )
+            logger.info("Записано %s из %s строк", min(offset + chunk, data_row_count), data_row_count)
+        logger.info("✅ Товары записаны на '%s' (%s строк), фильтр обновлён", sheet_name, data_row_count)
 
     def write_update_date(self, spreadsheet_id: str, sheet_name: str, when: Optional[datetime] = None) -> None:
         """Пишет дату/время обновления в H1 (формат 'дд.мм чч:мм')."""
@@ -295,12 +419,14 @@ class SheetAPIService:
         update_date = when.strftime("%d.%m %H:%M")
 
         try:
-            self.service.spreadsheets().values().update(
-                spreadsheetId=spreadsheet_id,
-                range=f"{sheet_name}!H1",
-                valueInputOption="USER_ENTERED",
-                body={"values": [[update_date]]},
-            ).execute()
+            self._execute(
+                self.service.spreadsheets().values().update(
+                    spreadsheetId=spreadsheet_id,
+                    range=f"{sheet_name}!H1",
+                    valueInputOption="USER_ENTERED",
+                    body={"values": [[update_date]]},
+                )
+            )
             logger.info("✅ Дата обновления записана: %s", update_date)
         except HttpError as e:
             raise RuntimeError(f"Ошибка записи даты обновления: {e}") from e
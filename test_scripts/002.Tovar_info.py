@@ -1,5 +1,6 @@
 import asyncio
 import aiohttp
+import orjson
 from google.oauth2 import service_account
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -38,25 +39,24 @@ headers = {
 
 product_info_url = 'https://api-seller.ozon.ru/v3/product/info/list'
 
+# Учетные данные и клиент Sheets создаются один раз на весь запуск
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+creds = service_account.Credentials.from_service_account_file('credentials.json', scopes=SCOPES)
+service = build('sheets', 'v4', credentials=creds, cache_discovery=False, static_discovery=True)
+
 def format_date(iso_date):
-    if not iso_date:
-        return 'N/A'
-    try:
-        for fmt in ("%Y-%m-%dT%H:%M:%S.%fZ", "%Y-%m-%dT%H:%M:%SZ"):
-            try:
-                return datetime.strptime(iso_date, fmt).strftime("%d.%m.%Y")
-            except ValueError:
-                continue
-        return 'N/A'
-    except Exception:
+    # Ozon отдает UTC в виде 'YYYY-MM-DDTHH:MM:SS[.ffffff]Z': дату берем срезами, без strptime и исключений
+    if not iso_date or not isinstance(iso_date, str):
         return 'N/A'
+    if len(iso_date) >= 20 and iso_date[4] == '-' and iso_date[7] == '-' and iso_date[10] == 'T' and iso_date[-1] == 'Z':
+        year, month, day = iso_date[0:4], iso_date[5:7], iso_date[8:10]
+        if year.isdigit() and month.isdigit() and day.isdigit():
+            return f"{day}.{month}.{year}"
+    return 'N/A'
 
 def write_update_date_to_h1():
     """Записывает текущую дату и время в ячейку H1 в формате 'дд.мм чч:мм'"""
     try:
-        creds = service_account.Credentials.from_service_account_file('credentials.json')
-        service = build('sheets', 'v4', credentials=creds)
-        
         # Получаем текущую дату и время в нужном формате
         current_date = datetime.now().strftime("%d.%m %H:%M")
         
@@ -81,26 +81,32 @@ def write_update_date_to_h1():
 
 def get_product_ids_from_google_sheets():
     try:
-        creds = service_account.Credentials.from_service_account_file('credentials.json')
-        service = build('sheets', 'v4', credentials=creds)
+        # Один столбец целиком, числа приходят числами (UNFORMATTED_VALUE), без метаданных диапазона
         result = service.spreadsheets().values().get(
             spreadsheetId=spreadsheet_id,
-            range=f"{sheet_name}!A5:A"
+            range=f"{sheet_name}!A5:A",
+            majorDimension='COLUMNS',
+            valueRenderOption='UNFORMATTED_VALUE',
+            fields='values'
         ).execute()
-        return [int(row[0]) for row in result.get('values', []) if row and row[0].strip().isdigit()]
+        column = result.get('values', [[]])[0]
+        # id, записанный текстом, по-прежнему принимаем
+        return [
+            int(value) for value in column
+            if type(value) is int or (type(value) is float and value.is_integer())
+            or (isinstance(value, str) and value.strip().isdigit())
+        ]
     except Exception as e:
         logger.error(f"Ошибка получения ID: {e}")
         return []
 
-def write_data_to_google_sheets(product_ids, data):
+def write_data_to_google_sheets(product_ids, data, start_row=5):
+    """Пишет пачку товаров в строки, начиная со start_row. Возвращает True при успешной записи"""
     try:
-        creds = service_account.Credentials.from_service_account_file('credentials.json')
-        service = build('sheets', 'v4', credentials=creds)
-        
         data_dict = {item['id']: item for item in data}
-        values_b, values_c = [], []
-        values_e, values_f, values_g = [], [], []
-        values_i, values_n = [], []
+        # Плоские столбцы вместо списка строк; D, H и J:M этот скрипт не заполняет,
+        # поэтому они просто не входят ни в один диапазон записи
+        col_b, col_c, col_e, col_f, col_g, col_i, col_n = [], [], [], [], [], [], []
 
         for product_id in product_ids:
             item = data_dict.get(product_id, {})
@@ -112,54 +118,56 @@ def write_data_to_google_sheets(product_ids, data):
             
             # Остальные данные
             sources = item.get('sources', [])
-            sku = sources[0].get('sku', 'N/A') if sources else 'N/A'
-            barcode = item.get('barcodes', ['N/A'])[0]
-            is_super = '✔️' if item.get('is_super') is True else '❌' if item.get('is_super') is False else 'N/A'
+            col_b.append(sources[0].get('sku', 'N/A') if sources else 'N/A')
+            col_c.append(image_formula)
+            col_e.append(item.get('name', 'N/A'))
+            col_f.append(item.get('barcodes', ['N/A'])[0])
+            col_g.append('✔️' if item.get('is_super') is True else '❌' if item.get('is_super') is False else 'N/A')
             
             # Даты
-            created_at = format_date(item.get('created_at'))
-            updated_at = format_date(item.get('updated_at'))
-
-            values_b.append([sku])
-            values_c.append([image_formula])
-            values_e.append([item.get('name', 'N/A')])
-            values_f.append([barcode])
-            values_g.append([is_super])
-            values_i.append([created_at])
-            values_n.append([updated_at])
+            col_i.append(format_date(item.get('created_at')))
+            col_n.append(format_date(item.get('updated_at')))
 
+        last_row = start_row + len(product_ids) - 1
         body = {
             'valueInputOption': 'USER_ENTERED',
             'data': [
-                {'range': f"{sheet_name}!B5:B{len(values_b)+4}", 'values': values_b},
-                {'range': f"{sheet_name}!C5:C{len(values_c)+4}", 'values': values_c},
-                {'range': f"{sheet_name}!E5:E{len(values_e)+4}", 'values': values_e},
-                {'range': f"{sheet_name}!F5:F{len(values_f)+4}", 'values': values_f},
-                {'range': f"{sheet_name}!G5:G{len(values_g)+4}", 'values': values_g},
-                {'range': f"{sheet_name}!I5:I{len(values_i)+4}", 'values': values_i},
-                {'range': f"{sheet_name}!N5:N{len(values_n)+4}", 'values': values_n}
+                {'range': f"{sheet_name}!{first}{start_row}:{last}{last_row}",
+                 'majorDimension': 'COLUMNS', 'values': values}
+                for first, last, values in (
+                    ('B', 'C', [col_b, col_c]),
+                    ('E', 'G', [col_e, col_f, col_g]),
+                    ('I', 'I', [col_i]),
+                    ('N', 'N', [col_n]),
+                )
             ]
         }
         service.spreadsheets().values().batchUpdate(
             spreadsheetId=spreadsheet_id,
             body=body
         ).execute()
-        logger.info("Данные успешно записаны")
-        
-        # Записываем дату обновления после успешной записи данных
-        write_update_date_to_h1()
+        logger.info(f"Данные успешно записаны в строки {start_row}-{last_row}")
+        return True
         
     except Exception as e:
         logger.error(f"Ошибка записи: {e}")
+        return False
+
+# Сколько пачек product info запрашивать одновременно
+CONCURRENT_REQUEST_LIMIT = 8
+# Размер пачки product info (максимум API)
+BATCH_SIZE = 1000
 
-async def fetch_product_info(session, product_ids):
+async def fetch_product_info(session, semaphore, product_ids):
     try:
-        async with session.post(product_info_url, headers=headers, json={"product_id": product_ids}) as response:
-            if response.status == 200:
-                data = await response.json()
-                return data.get('items', [])
-            logger.error(f"Ошибка API: {response.status}")
-            return []
+        async with semaphore:
+            async with session.post(product_info_url, headers=headers, data=orjson.dumps({"product_id": product_ids})) as response:
+                if response.status == 200:
+                    # ответ на 1000 товаров ~1 МБ: orjson разбирает его в разы быстрее json.loads
+                    data = orjson.loads(await response.read())
+                    return data.get('items', [])
+                logger.error(f"Ошибка API: {response.status}")
+                return []
     except Exception as e:
         logger.error(f"Ошибка запроса: {e}")
         return []
@@ -169,18 +177,57 @@ async def main():
     if not product_ids:
         return
 
-    async with aiohttp.ClientSession() as session:
-        all_data = []
-        for i in range(0, len(product_ids), 1000):
-            batch = product_ids[i:i+1000]
-            data = await fetch_product_info(session, batch)
-            if data:
-                all_data.extend(data)
-        
-        if all_data:
-            write_data_to_google_sheets(product_ids, all_data)
-        else:
-            logger.error("Нет данных для записи")
+    semaphore = asyncio.Semaphore(CONCURRENT_REQUEST_LIMIT)
+    # Все пачки идут к одному хосту: держим столько keep-alive соединений, сколько одновременных запросов,
+    # и не резолвим DNS на каждое новое соединение
+    connector = aiohttp.TCPConnector(limit_per_host=CONCURRENT_REQUEST_LIMIT, ttl_dns_cache=300, keepalive_timeout=60)
+    # Готовые пачки пишутся в таблицу, пока остальные еще запрашиваются у Ozon
+    queue = asyncio.Queue(maxsize=2)
+
+    async def fetch_batch(session, offset):
+        data = await fetch_product_info(session, semaphore, product_ids[offset:offset+BATCH_SIZE])
+        await queue.put((offset, data))
+
+    async def produce(session):
+        # Все пачки параллельно (не больше CONCURRENT_REQUEST_LIMIT одновременно), в очередь — по готовности
+        await asyncio.gather(*(fetch_batch(session, i) for i in range(0, len(product_ids), BATCH_SIZE)))
+        await queue.put(None)
+
+    async def write_batch(offset, data):
+        # googleapiclient синхронный: запись в отдельном потоке, чтобы не стопорить запросы к Ozon
+        return await asyncio.to_thread(
+            write_data_to_google_sheets, product_ids[offset:offset+BATCH_SIZE], data, 5 + offset
+        )
+
+    async def consume():
+        written, success = 0, True
+        # Неполученные пачки откладываются до первой успешной: если Ozon не ответил ни на одну,
+        # таблица не трогается (как раньше при пустом all_data)
+        failed_offsets = []
+        while (batch := await queue.get()) is not None:
+            offset, data = batch
+            if not data:
+                # H1 не помечается как обновленный
+                success = False
+                if not written:
+                    failed_offsets.append(offset)
+                    continue
+            else:
+                written += 1
+            success = await write_batch(offset, data) and success
+            # Отложенные пачки перезаписываются N/A, чтобы не остались данные прошлого запуска
+            while failed_offsets:
+                success = await write_batch(failed_offsets.pop(), []) and success
+        return written, success
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        _, (written, success) = await asyncio.gather(produce(session), consume())
+
+    if not written:
+        logger.error("Нет данных для записи")
+    elif success:
+        # Записываем дату обновления после успешной записи данных
+        write_update_date_to_h1()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
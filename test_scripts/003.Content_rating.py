@@ -1,7 +1,11 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
-import gspread
+from requests.adapters import HTTPAdapter
 from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
 # Получаем абсолютный путь к файлу credentials.json
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -36,17 +40,24 @@ def read_api_file(file_path):
 API_FILE = os.path.join(SCRIPT_DIR, "(1)API.txt")
 CLIENT_ID, API_KEY, SPREADSHEET_ID, SHEET_NAME = read_api_file(API_FILE)
 
+# Сколько групп SKU запрашивать одновременно
+CONCURRENT_REQUEST_LIMIT = 10
+
+# Общая HTTP-сессия: keep-alive и пул соединений на все потоки
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=CONCURRENT_REQUEST_LIMIT))
+session.headers.update({
+    "Client-Id": CLIENT_ID,
+    "Api-Key": API_KEY,
+    "Content-Type": "application/json"
+})
+
 def get_product_ratings_batch(sku_list):
     url = "https://api-seller.ozon.ru/v1/product/rating-by-sku"
-    headers = {
-        "Client-Id": CLIENT_ID,
-        "Api-Key": API_KEY,
-        "Content-Type": "application/json"
-    }
     payload = {"skus": sku_list}
 
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=15)
+        response = session.post(url, json=payload, timeout=15)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -64,20 +75,26 @@ def main():
 
         print("[ИНФО] Авторизация в Google Sheets...")
         creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-        client = gspread.authorize(creds)
+        # Sheets API напрямую: без открытия таблицы и списка листов перед чтением
+        sheets = build("sheets", "v4", credentials=creds, cache_discovery=False).spreadsheets()
 
-        print("[ИНФО] Открытие таблицы...")
+        print("[ИНФО] Чтение списка SKU из столбца B...")
         try:
-            sheet = client.open_by_key(SPREADSHEET_ID).worksheet(SHEET_NAME)
-        except gspread.exceptions.APIError as e:
+            result = sheets.values().get(
+                spreadsheetId=SPREADSHEET_ID,
+                range=f"{SHEET_NAME}!B5:B",
+                majorDimension="COLUMNS",
+                # SKU приходят числами, без форматирования и метаданных диапазона
+                valueRenderOption="UNFORMATTED_VALUE",
+                fields="values"
+            ).execute()
+        except HttpError as e:
             raise Exception("Ошибка доступа к таблице. Проверьте SPREADSHEET_ID и SHEET_NAME") from e
-
-        print("[ИНФО] Чтение списка SKU из столбца B...")
-        skus_data = sheet.get("B5:B")
+        skus_data = result.get("values", [[]])[0]
         if not skus_data:
             raise ValueError("Не найдены SKU в столбце B")
 
-        sku_values = [row[0] for row in skus_data if row and row[0]]
+        sku_values = [sku for sku in skus_data if sku]
         total_skus = len(sku_values)
         print(f"[ИНФО] Найдено {total_skus} SKU. Начинаем групповую обработку...")
 
@@ -87,12 +104,14 @@ def main():
         error_count = 0
         index_pointer = 0  # Смещение для правильной привязки к строкам Google Sheets
 
-        for i in range(0, total_skus, BATCH_SIZE):
-            batch = sku_values[i:i+BATCH_SIZE]
-            print(f"[ИНФО] Обработка SKU с {i+5} по {i+5+len(batch)-1}...")
+        batches = [sku_values[i:i+BATCH_SIZE] for i in range(0, total_skus, BATCH_SIZE)]
+        print(f"[ИНФО] Запрос {len(batches)} групп SKU (до {CONCURRENT_REQUEST_LIMIT} одновременно)...")
 
-            rating_info = get_product_ratings_batch(batch)
+        # Группы запрашиваем параллельно; map возвращает ответы в исходном порядке групп
+        with ThreadPoolExecutor(max_workers=CONCURRENT_REQUEST_LIMIT) as executor:
+            responses = list(executor.map(get_product_ratings_batch, batches))
 
+        for batch, rating_info in zip(batches, responses):
             # Словарь: SKU -> рейтинг
             sku_to_rating = {}
             if rating_info and "products" in rating_info:
@@ -105,15 +124,20 @@ def main():
             # Заполняем результаты
             for sku in batch:
                 if str(sku) in sku_to_rating:
-                    ratings.append([sku_to_rating[str(sku)]])
+                    ratings.append(sku_to_rating[str(sku)])
                     processed_count += 1
                 else:
-                    ratings.append(["Ошибка получения рейтинга"])
+                    ratings.append("Ошибка получения рейтинга")
                     error_count += 1
 
         print("\n[ИНФО] Запись рейтингов в столбец H начиная с H5...")
         if ratings:
-            sheet.update(range_name=f"H5:H{5 + len(ratings) - 1}", values=ratings)
+            sheets.values().update(
+                spreadsheetId=SPREADSHEET_ID,
+                range=f"{SHEET_NAME}!H5:H{5 + len(ratings) - 1}",
+                valueInputOption="RAW",
+                body={"majorDimension": "COLUMNS", "values": [ratings]}
+            ).execute()
             print(f"[ГОТОВО] Успешно обновлено {processed_count} товаров.")
             print(f"[СТАТИСТИКА] Ошибок: {error_count}")
 
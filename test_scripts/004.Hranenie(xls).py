@@ -8,6 +8,17 @@ import pandas as pd
 from pprint import pprint
 from datetime import datetime
 
+# Rust-парсер calamine (pip install python-calamine) читает xlsx/xls в разы быстрее openpyxl;
+# если пакет не установлен, остаемся на openpyxl
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = 'openpyxl'
+
+# Дата в начале имени файла отчета: YYYY-MM-DD
+FILE_DATE_RE = re.compile(r'^(\d{4})-(\d{2})-(\d{2})')
+
 def log_step(message, data=None):
     print(f"\n[ШАГ] {message}")
     if data:
@@ -42,64 +53,82 @@ def read_api_config(file_path='(1)API.txt'):
         log_error("Ошибка чтения файла API.txt", e)
         raise
 
-def process_value(value):
-    """Обработка значения: округление чисел, проверка на ноль и NaN"""
-    if pd.isna(value) or str(value).lower() in ['nan', 'none', '']:
-        return None
-    
-    try:
-        num = float(value)
-        if num == 0:
-            return None
-        return math.ceil(num)
-    except (ValueError, TypeError):
-        return str(value) if value else None
+def process_values(column):
+    """
+    Обработка столбца значений: числа округляются вверх, ноль и NaN/пустое → None,
+    нечисловой текст остается строкой
+    """
+    numbers = pd.to_numeric(column, errors='coerce')
+    result = np.full(len(column), None, dtype=object)
+
+    numeric = (numbers.notna() & (numbers != 0)).to_numpy()
+    result[numeric] = np.ceil(numbers[numeric]).astype(np.int64).tolist()
+
+    text = column.astype(str)
+    is_text = (numbers.isna() & column.notna() & ~text.str.lower().isin(['nan', 'none', ''])).to_numpy()
+    result[is_text] = text[is_text].tolist()
+    return result
 
 def prepare_data_for_column(articles, data_map):
     """Подготовка данных для одного столбца"""
-    values = []
-    stats = {'matched': 0, 'zeros_skipped': 0, 'nan_skipped': 0, 'not_found': 0}
-    
-    for article in articles:
-        val = data_map.get(article)
-        
-        if val is None:
-            if article in data_map:
-                if isinstance(data_map[article], float) and math.isnan(data_map[article]):
-                    values.append([''])
-                    stats['nan_skipped'] += 1
-                else:
-                    values.append([''])
-                    stats['zeros_skipped'] += 1
-            else:
-                values.append([''])
-                stats['not_found'] += 1
-        else:
-            values.append([val])
-            stats['matched'] += 1
+    # object-dtype: целые из process_values не превращаются во float при reindex
+    series = pd.Series(data_map, dtype=object)
+    found = pd.Index(articles).isin(series.index)
+    column = series.reindex(articles)
+    present = column.notna().to_numpy()
+
+    # Найденные артикулы без значения: NaN считаем отдельно от нулей/пустых
+    skipped = column[found & ~present]
+    nan_skipped = int(sum(isinstance(v, float) and math.isnan(v) for v in skipped))
+
+    stats = {
+        'matched': int(present.sum()),
+        'zeros_skipped': len(skipped) - nan_skipped,
+        'nan_skipped': nan_skipped,
+        'not_found': int((~found).sum())
+    }
+    values = [[v] for v in column.where(present, '').tolist()]
     
     stats['total'] = len(articles)
     stats['match_percent'] = round(stats['matched']/stats['total']*100, 2)
     return values, stats
 
+def column_letter_index(letters):
+    """Буквы столбца Excel → 0-based индекс ('A' → 0, 'AA' → 26)"""
+    index = 0
+    for ch in letters.upper():
+        index = index * 26 + (ord(ch) - ord('A') + 1)
+    return index - 1
+
 def read_excel_columns(xls, config):
     """Чтение данных из Excel файла"""
-    articles_col = pd.read_excel(
+    xlsx_columns = config['xlsx_columns']
+    col_keys = {
+        'article': 'article_column',
+        'price': 'price_column',
+        'additional1': 'additional1_column',
+        'additional2': 'additional2_column',
+        'additional3': 'additional3_column'
+    }
+    # Все нужные столбцы одним чтением листа: каждый read_excel заново проходит все строки
+    usecols = sorted({column_letter_index(xlsx_columns[key]) for key in col_keys.values()})
+    df = pd.read_excel(
         xls, sheet_name=0,
-        usecols=config['xlsx_columns']['article_column'],
+        usecols=usecols,
         header=None,
-        skiprows=config['xlsx_columns']['start_row']-1
+        skiprows=xlsx_columns['start_row']-1
     )
-    
-    columns = {}
-    for col_type in ['price', 'additional1', 'additional2', 'additional3']:
-        col_key = f"{'price' if col_type == 'price' else 'additional'}{'' if col_type == 'price' else col_type[-1]}_column"
-        columns[col_type] = pd.read_excel(
-            xls, sheet_name=0,
-            usecols=config['xlsx_columns'][col_key],
-            header=None,
-            skiprows=config['xlsx_columns']['start_row']-1
-        ).replace({np.nan: None})
+    # read_excel возвращает столбцы в порядке листа — берем их по позиции
+    position = {index: i for i, index in enumerate(usecols)}
+
+    def column(key):
+        return df.iloc[:, [position[column_letter_index(xlsx_columns[key])]]]
+
+    articles_col = column(col_keys['article'])
+    columns = {
+        col_type: column(col_keys[col_type]).replace({np.nan: None})
+        for col_type in ['price', 'additional1', 'additional2', 'additional3']
+    }
     
     return articles_col, columns
 
@@ -110,7 +139,7 @@ def update_totals_and_date(worksheet, file_path=None):
         if file_path:
             file_name = os.path.basename(file_path)
             # Ищем дату в формате YYYY-MM-DD в начале названия файла
-            date_match = re.search(r'^(\d{4})-(\d{2})-(\d{2})', file_name)
+            date_match = FILE_DATE_RE.match(file_name)
             if date_match:
                 year, month, day = date_match.groups()
                 current_date = f"XLS от {day}.{month}"
@@ -120,32 +149,21 @@ def update_totals_and_date(worksheet, file_path=None):
         else:
             current_date = f"Файл от {datetime.now().strftime('%d.%m.%Y')}"
         
-        # Получаем данные из столбцов
-        j_values = worksheet.get('J5:J')
-        k_values = worksheet.get('K5:K')
-        l_values = worksheet.get('L5:L')
-        
-        # Функция для расчета суммы
-        def calculate_sum(values):
-            total = 0
-            for row in values:
-                if row and row[0]:
-                    try:
-                        total += float(row[0])
-                    except (ValueError, TypeError):
-                        continue
-            return total
+        # Получаем данные столбцов J:L одним запросом
+        jkl_values = worksheet.get('J5:L')
         
-        # Вычисляем суммы
-        j_sum = calculate_sum(j_values)
-        k_sum = calculate_sum(k_values)
-        l_sum = calculate_sum(l_values)
+        # Суммы по столбцам J, K, L: нечисловые значения → NaN и в сумму не идут
+        jkl_frame = pd.DataFrame(jkl_values).reindex(columns=range(3))
+        sums = [float(pd.to_numeric(jkl_frame[i], errors='coerce').sum()) for i in range(3)]
+        j_sum, k_sum, l_sum = sums
         
-        # Обновляем ячейки
-        worksheet.update(values=[[j_sum]], range_name='J4')
-        worksheet.update(values=[[k_sum]], range_name='K4')
-        worksheet.update(values=[[l_sum]], range_name='L4')
-        worksheet.update(values=[[current_date]], range_name='J1')
+        # Обновляем ячейки одним запросом
+        worksheet.batch_update([
+            {'range': 'J4', 'values': [[j_sum]]},
+            {'range': 'K4', 'values': [[k_sum]]},
+            {'range': 'L4', 'values': [[l_sum]]},
+            {'range': 'J1', 'values': [[current_date]]}
+        ])
         
         log_step("Итоговые суммы и дата обновлены", {
             'J4 (сумма J5:J)': j_sum,
@@ -210,19 +228,19 @@ def main():
         if not files:
             raise FileNotFoundError(f"Файлы с паттерном '{CONFIG['file_pattern']}' не найдены")
         target_file = os.path.join(CONFIG['search_folder'], files[0])
-        log_step(f"Найден файл для обработки: {target_file}")
+        log_step(f"Найден файл для обработки: {target_file} (движок чтения: {EXCEL_ENGINE})")
 
         # Чтение и обработка данных из Excel
-        with pd.ExcelFile(target_file, engine='openpyxl') as xls:
+        with pd.ExcelFile(target_file, engine=EXCEL_ENGINE) as xls:
             articles_col, columns = read_excel_columns(xls, CONFIG)
             
+            # Артикулы нормализуются один раз, значения каждого столбца — векторно
+            has_article = articles_col.iloc[:, 0].notna().to_numpy()
+            article_keys = articles_col.iloc[:, 0][has_article].astype(str).str.strip().tolist()
             data_maps = {}
             for col_type in ['price', 'additional1', 'additional2', 'additional3']:
-                data_maps[col_type] = {
-                    str(art).strip(): process_value(val)
-                    for art, val in zip(articles_col.iloc[:, 0], columns[col_type].iloc[:, 0])
-                    if pd.notna(art)
-                }
+                values = process_values(columns[col_type].iloc[:, 0])
+                data_maps[col_type] = dict(zip(article_keys, values[has_article].tolist()))
 
         # Подготовка данных для всех столбцов
         results = {}
@@ -7,13 +7,16 @@
 - 'turnover_grade' в столбец AL с переводом значений
 """
 
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
 from datetime import datetime
 import time
 import sys
 import math
+import random
 
 # Словарь перевода для turnover_grade
 TURNOVER_GRADE_TRANSLATION = {
@@ -26,6 +29,44 @@ TURNOVER_GRADE_TRANSLATION = {
     '': ''
 }
 
+# Общая HTTP-сессия: keep-alive и пул соединений для всех запросов к Ozon API
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=20
+))
+
+# Лимит API по умолчанию - 1 запрос в 65 секунд (если сервер не сообщил иное)
+RATE_LIMIT_INTERVAL = 65
+# Пауза после ошибки: экспоненциально от базовой, но не дольше потолка
+RETRY_BASE_DELAY = 60
+RETRY_MAX_DELAY = 300
+
+def rate_limit_delay(response, request_started):
+    """Сколько секунд ждать перед следующим запросом с учетом заголовков ответа"""
+    headers = response.headers
+    retry_after = headers.get('Retry-After')
+    if retry_after:
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+
+    remaining = headers.get('X-RateLimit-Remaining')
+    reset = headers.get('X-RateLimit-Reset')
+    if remaining is not None and reset is not None:
+        try:
+            if int(remaining) > 0:
+                return 0.0
+            reset = float(reset)
+            # Reset может прийти как epoch-время или как число секунд до сброса
+            return max(0.0, reset - time.time()) if reset > 1e9 else max(0.0, reset)
+        except ValueError:
+            pass
+
+    # Заголовков нет - выдерживаем стандартное окно, не считая уже прошедшее время
+    return max(0.0, RATE_LIMIT_INTERVAL - (time.monotonic() - request_started))
+
 def read_api_credentials(file_path='(1)API.txt'):
     """Чтение учетных данных из файла"""
     try:
@@ -46,11 +87,11 @@ def read_api_credentials(file_path='(1)API.txt'):
 def get_all_ozon_data(client_id, api_key, max_retries=3):
     """Получение данных об остатках с Ozon API"""
     url = "https://api-seller.ozon.ru/v1/analytics/turnover/stocks"
-    headers = {
+    _session.headers.update({
         "Client-Id": client_id,
         "Api-Key": api_key,
         "Content-Type": "application/json"
-    }
+    })
 
     all_items = []
     offset = 0
@@ -61,10 +102,11 @@ def get_all_ozon_data(client_id, api_key, max_retries=3):
             payload = {"limit": 1000, "offset": offset}
             print(f"Запрос данных (offset: {offset})...")
 
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
+            request_started = time.monotonic()
+            response = _session.post(url, data=orjson.dumps(payload), timeout=30)
             response.raise_for_status()
 
-            data = response.json()
+            data = orjson.loads(response.content)
             items = data.get('items', [])
 
             if not items:
@@ -77,14 +119,22 @@ def get_all_ozon_data(client_id, api_key, max_retries=3):
             if len(items) < 1000:
                 break
 
-            time.sleep(65)  # Лимит API - 1 запрос в 65 секунд
+            delay = rate_limit_delay(response, request_started)
+            if delay:
+                print(f"Ожидание лимита API: {delay:.0f} сек.")
+                time.sleep(delay)
 
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             retry_count += 1
             if retry_count > max_retries:
                 raise
             print(f"Ошибка ({retry_count}/{max_retries}): {str(e)}")
-            time.sleep(60)
+            response = getattr(e, 'response', None)
+            if response is not None and response.headers.get('Retry-After'):
+                delay = rate_limit_delay(response, time.monotonic())
+            else:
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (retry_count - 1)) + random.uniform(0, 5)
+            time.sleep(delay)
             continue
 
     return all_items
@@ -95,41 +145,47 @@ def update_google_sheets(items, credentials, start_row=5):
         # Авторизация в Google Sheets
         scope = ['https://spreadsheets.google.com/feeds', 
                 'https://www.googleapis.com/auth/drive']
-        creds = ServiceAccountCredentials.from_json_keyfile_name(
-            'credentials.json', scope)
+        creds = Credentials.from_service_account_file('credentials.json', scopes=scope)
         client = gspread.authorize(creds)
         
         # Открытие таблицы
         sheet = client.open_by_key(credentials['spreadsheet_id']).worksheet(
             credentials['sheet_name'])
 
-        # Получение offer_id из колонки D
-        offer_ids = sheet.col_values(4)[start_row-1:]  # Колонка D
-
-        # Подготовка данных для записи
-        data_to_write = []
-        
-        for offer_id in offer_ids:
-            offer_id = str(offer_id).strip()
-            item = next((item for item in items if item.get('offer_id') == offer_id), None)
-            
-            # Формируем строку данных
-            row_data = [
-                item.get('ads', '') if item else '',  # Столбец AJ
-                math.ceil(item['idc']) if item and isinstance(item.get('idc'), (int, float)) else '',  # Столбец AK
-                TURNOVER_GRADE_TRANSLATION.get(item.get('turnover_grade', ''), '') if item else ''  # Столбец AL
+        # Получение offer_id из колонки D: запрашиваем сразу нужный диапазон одним столбцом,
+        # без строк шапки, которые раньше отбрасывались срезом
+        column_d = sheet.get(f"D{start_row}:D", major_dimension='COLUMNS')
+        offer_ids = column_d[0] if column_d else []
+
+        # Готовая строка AJ:AL на каждый offer_id (первое вхождение, как при линейном поиске):
+        # перевод и округление считаются один раз на товар, а не на каждую строку листа
+        trans = TURNOVER_GRADE_TRANSLATION.get
+        ceil = math.ceil
+        isnum = (int, float)
+        rows_by_offer = {}
+        for it in items:
+            offer_id = it.get('offer_id')
+            if offer_id in rows_by_offer:
+                continue
+            idc = it.get('idc')
+            rows_by_offer[offer_id] = [
+                it.get('ads', ''),  # Столбец AJ
+                ceil(idc) if isinstance(idc, isnum) else '',  # Столбец AK
+                trans(it.get('turnover_grade', ''), '')  # Столбец AL
             ]
-            data_to_write.append(row_data)
 
-        # Очистка и запись данных
-        print("Очистка диапазона AJ{0}:AL{1}...".format(start_row, start_row + len(data_to_write)))
-        sheet.batch_clear([f"AJ{start_row}:AL{start_row + len(data_to_write)}"])
-        
-        # Запись всех данных разом
-        print("Запись данных в таблицу...")
+        # Подготовка данных для записи
+        empty_row = ['', '', '']
+        rows_get = rows_by_offer.get
+        data_to_write = [rows_get(str(offer_id).strip(), empty_row) for offer_id in offer_ids]
+
+        # Очистка и запись одним запросом: пустая строка в конце затирает
+        # последнюю строку диапазона, которую раньше очищал batch_clear
+        end_row = start_row + len(data_to_write)
+        print(f"Запись данных в таблицу (AJ{start_row}:AL{end_row})...")
         sheet.update(
-            range_name=f"AJ{start_row}:AL{start_row + len(data_to_write) - 1}",
-            values=data_to_write
+            range_name=f"AJ{start_row}:AL{end_row}",
+            values=data_to_write + [empty_row]
         )
 
     except Exception as e:
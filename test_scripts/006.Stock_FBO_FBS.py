@@ -1,6 +1,11 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+from google.oauth2.service_account import Credentials
 
 # Функция для чтения данных из файла (1)API.txt с указанием кодировки utf-8
 def read_api_credentials(filename):
@@ -29,14 +34,21 @@ credentials_file = "credentials.json"
 
 # Настройка для доступа к Google Sheets
 scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, scope)
+creds = Credentials.from_service_account_file(credentials_file, scopes=scope)
 client = gspread.authorize(creds)
 
 # Откройте Google Sheets по ID таблицы и выберите лист
 sheet = client.open_by_key(sheet_id).worksheet(sheet_name)
 
-# Получаем product_id из Google Sheets начиная с 5-й строки столбца A
-product_ids = [int(pid) for pid in sheet.col_values(1)[4:] if pid.strip().isdigit()]  # Преобразуем в int и проверяем, что это число
+# Получаем product_id из Google Sheets начиная с 5-й строки столбца A.
+# UNFORMATTED_VALUE отдает числа уже числами, строку разбираем только если id записан текстом
+product_ids = []
+for row in sheet.get('A5:A', value_render_option='UNFORMATTED_VALUE'):
+    pid = row[0] if row else None
+    if type(pid) is int:
+        product_ids.append(pid)
+    elif isinstance(pid, str) and pid.strip().isdigit():
+        product_ids.append(int(pid))
 
 # Очищаем только R5:R и S5:S перед загрузкой новых данных (столбец I не трогаем)
 if product_ids:  # Проверяем, что есть хотя бы один product_id
@@ -45,6 +57,9 @@ if product_ids:  # Проверяем, что есть хотя бы один pr
 # Устанавливаем URL нового метода API
 api_url = "https://api-seller.ozon.ru/v4/product/info/stocks"
 
+# Сколько запросов остатков выполнять одновременно (блоки независимы друг от друга)
+CONCURRENT_REQUEST_LIMIT = 4
+
 # Запрашиваем остатки товаров
 headers = {
     "Client-Id": client_id,
@@ -52,6 +67,19 @@ headers = {
     "Content-Type": "application/json"
 }
 
+# Общая HTTP-сессия: keep-alive и пул соединений для всех запросов к Ozon API
+session = requests.Session()
+session.mount("https://", HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=1,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=["POST"],
+                      # после исчерпания повторов вернуть последний ответ, а не бросать RetryError
+                      raise_on_status=False)
+))
+session.headers.update(headers)
+
 def get_stock_data(product_ids_chunk):
     body = {
         "filter": {
@@ -60,50 +88,51 @@ def get_stock_data(product_ids_chunk):
         "limit": 1000
     }
 
-    response = requests.post(api_url, headers=headers, json=body)
+    try:
+        response = session.post(api_url, data=orjson.dumps(body))
+    except requests.exceptions.RequestException as e:
+        # Ошибка одного блока не должна прерывать запись остальных
+        print(f"Ошибка при запросе: {e}")
+        return None
     
     if response.status_code == 200:
-        return response.json()
+        return orjson.loads(response.content)
     else:
         print(f"Ошибка при запросе: {response.status_code}")
         print(f"Тело ответа: {response.text}")  # Используем text вместо json(), чтобы избежать ошибок при невалидном JSON
         return None
 
 def update_google_sheet(data, product_ids):
-    rows_fbo = []
-    rows_fbs = []
-    
-    stock_dict = {str(item['product_id']): item['stocks'] for item in data['items']}
-
-    for product_id in product_ids:
-        stocks = stock_dict.get(str(product_id), [])
-        
-        fbo_stock = 0
-        fbs_stock = 0
-        
-        for stock in stocks:
-            if stock['type'] == 'fbo':
-                fbo_stock += stock['present']
-            elif stock['type'] == 'fbs':
-                fbs_stock += stock['present']
-        
-        rows_fbo.append([fbo_stock])
-        rows_fbs.append([fbs_stock])
+    # Суммы FBO/FBS за один проход по остаткам товара (ключ - int product_id, как в product_ids)
+    totals = {}
+    for item in data['items']:
+        fbo = fbs = 0
+        for stock in item['stocks']:
+            stock_type = stock['type']
+            if stock_type == 'fbo':
+                fbo += stock['present']
+            elif stock_type == 'fbs':
+                fbs += stock['present']
+        totals[int(item['product_id'])] = (fbo, fbs)
+
+    # Одна строка на товар: [FBO, FBS] для соседних столбцов R и S
+    rows_rs = [list(totals.get(product_id, (0, 0))) for product_id in product_ids]
     
     start_row = 5
-    if rows_fbo:  # Проверяем, что есть данные для записи
-        sheet.update(range_name=f'R{start_row}:R{start_row + len(rows_fbo) - 1}', values=rows_fbo)
-        sheet.update(range_name=f'S{start_row}:S{start_row + len(rows_fbs) - 1}', values=rows_fbs)
+    if rows_rs:  # Проверяем, что есть данные для записи
+        # R и S записываем одним запросом
+        sheet.update(range_name=f'R{start_row}:S{start_row + len(rows_rs) - 1}', values=rows_rs)
 
 # Разбиваем product_ids на блоки по 1000 элементов
 chunks = [product_ids[i:i + 1000] for i in range(0, len(product_ids), 1000)] if product_ids else []
 
 final_data = {'items': []}
 
-for chunk in chunks:
-    stock_data = get_stock_data(chunk)
-    if stock_data:
-        final_data['items'].extend(stock_data['items'])
+# Блоки запрашиваем параллельно; map сохраняет исходный порядок блоков
+with ThreadPoolExecutor(max_workers=CONCURRENT_REQUEST_LIMIT) as executor:
+    for stock_data in executor.map(get_stock_data, chunks):
+        if stock_data:
+            final_data['items'].extend(stock_data['items'])
 
 if final_data['items']:  # Проверяем, что есть данные для обновления
     update_google_sheet(final_data, product_ids)
@@ -1,5 +1,7 @@
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime
 from zoneinfo import ZoneInfo
 import gspread
@@ -34,6 +36,24 @@ HEADERS = {
     "Content-Type": "application/json"
 }
 
+# Сколько поставок (bundle) запрашивать одновременно
+BUNDLE_WORKERS = 8
+
+# Общая сессия: keep-alive на все запросы; на 429/5xx urllib3 сам делает паузу
+# (с учетом Retry-After) и повторяет запрос
+SESSION = requests.Session()
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=BUNDLE_WORKERS,
+    max_retries=Retry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+    ),
+))
+SESSION.headers.update(HEADERS)
+
 # Статусы заказов
 VALID_STATUSES = [
     "ORDER_STATE_DATA_FILLING",
@@ -54,6 +74,9 @@ STATUS_TO_COLUMN = {
     "ORDER_STATE_REPORTS_CONFIRMATION_AWAITING": "AB"
 }
 
+# Позиция статуса в W:AB — индекс в векторе количеств SKU
+STATUS_INDEX = {status: i for i, status in enumerate(STATUS_TO_COLUMN)}
+
 class OzonDataProcessor:
     def __init__(self):
         try:
@@ -87,7 +110,8 @@ class OzonDataProcessor:
     
     def get_sku_list(self) -> List[str]:
         """Получение списка SKU из столбца B (начиная с 5 строки)"""
-        sku_list = self.sheet.col_values(2)[4:]  # B5:B
+        column_b = self.sheet.get('B5:B', major_dimension='COLUMNS')  # сразу B5:B, без шапки
+        sku_list = column_b[0] if column_b else []
         return [str(sku).strip() for sku in sku_list if sku]
     
     def fetch_supply_orders(self) -> List[Dict]:
@@ -105,7 +129,7 @@ class OzonDataProcessor:
             "filter": {"states": VALID_STATUSES},
             "paging": {"from_supply_order_id": from_id, "limit": limit}
         }
-        resp = requests.post(url, headers=HEADERS, json=payload)
+        resp = SESSION.post(url, json=payload)
         resp.raise_for_status()
         return resp.json().get("supply_order_id", [])
     
@@ -113,7 +137,7 @@ class OzonDataProcessor:
         """Получение деталей поставок"""
         url = "https://api-seller.ozon.ru/v2/supply-order/get"
         payload = {"order_ids": order_ids}
-        resp = requests.post(url, headers=HEADERS, json=payload)
+        resp = SESSION.post(url, json=payload)
         resp.raise_for_status()
         return resp.json().get("orders", [])
     
@@ -134,9 +158,8 @@ class OzonDataProcessor:
             if last_id:
                 payload["last_id"] = last_id
             
-            resp = requests.post(
+            resp = SESSION.post(
                 "https://api-seller.ozon.ru/v1/supply-order/bundle",
-                headers=HEADERS,
                 json=payload
             )
             resp.raise_for_status()
@@ -145,15 +168,15 @@ class OzonDataProcessor:
             items.extend(data.get("items", []))
             has_next = data.get("has_next", False)
             last_id = data.get("last_id", "")
-            time.sleep(0.5)
             
         return items
     
-    def collect_sku_data(self) -> Dict[str, Dict[str, int]]:
-        """Сбор данных по SKU и их статусам"""
+    def collect_sku_data(self) -> Dict[str, List[Optional[int]]]:
+        """Сбор данных по SKU: вектор количеств по статусам в порядке W:AB (None — статуса нет)"""
         sku_counts = {}
         orders = self.fetch_supply_orders()
         
+        bundles = []
         for order in orders:
             if order.get("state") == "ORDER_STATE_CANCELLED":
                 continue
@@ -165,89 +188,84 @@ class OzonDataProcessor:
             bundle_id = order.get("supplies", [{}])[0].get("bundle_id")
             if not bundle_id:
                 continue
-                
-            try:
-                items = self.fetch_bundle_items(bundle_id)
-                for item in items:
-                    sku = str(item.get('sku'))
-                    quantity = int(item.get('quantity', 0))
-                    
-                    if not sku:
-                        continue
+            bundles.append((bundle_id, status_code))
+        
+        # Товары поставок запрашиваются параллельно, суммируются по мере готовности
+        with ThreadPoolExecutor(max_workers=BUNDLE_WORKERS) as executor:
+            futures = {
+                executor.submit(self.fetch_bundle_items, bundle_id): (bundle_id, status_code)
+                for bundle_id, status_code in bundles
+            }
+            for future in as_completed(futures):
+                bundle_id, status_code = futures[future]
+                status_i = STATUS_INDEX[status_code]
+                try:
+                    items = future.result()
+                    for item in items:
+                        sku = str(item.get('sku'))
+                        quantity = int(item.get('quantity', 0))
                         
-                    if sku not in sku_counts:
-                        sku_counts[sku] = {}
-                    
-                    if status_code in sku_counts[sku]:
-                        sku_counts[sku][status_code] += quantity
-                    else:
-                        sku_counts[sku][status_code] = quantity
+                        if not sku:
+                            continue
+                            
+                        counts = sku_counts.get(sku)
+                        if counts is None:
+                            counts = sku_counts[sku] = [None] * len(STATUS_INDEX)
                         
-            except Exception as e:
-                print(f"Ошибка при обработке bundle {bundle_id}: {e}")
-                continue
+                        slot = counts[status_i]
+                        counts[status_i] = quantity if slot is None else slot + quantity
+                            
+                except Exception as e:
+                    print(f"Ошибка при обработке bundle {bundle_id}: {e}")
+                    continue
                 
         return sku_counts
     
-    def update_sheet(self, sku_counts: Dict[str, Dict[str, int]]):
+    def update_sheet(self, sku_counts: Dict[str, List[Optional[int]]]):
         """Обновление таблицы данными и расчет сумм"""
         sku_list = self.get_sku_list()
         if not sku_list:
             print("Не найдены SKU в таблице")
             return
             
-        # Очищаем диапазоны перед записью
         last_row = len(sku_list) + 4
-        self.sheet.batch_clear([
-            f"W3:AB3",  # Очищаем строку с суммами
-            f"T5:T{last_row}",  # Очищаем столбец с суммами
-            f"W5:W{last_row}",
-            f"X5:X{last_row}",
-            f"Y5:Y{last_row}",
-            f"Z5:Z{last_row}",
-            f"AA5:AA{last_row}",
-            f"AB5:AB{last_row}"
-        ])
         
-        # Подготавливаем обновления
-        updates = []
-        column_sums = {col: 0 for col in STATUS_TO_COLUMN.values()}
+        # Прямоугольник W5:AB и столбец T: пустая строка там, где данных нет —
+        # так весь диапазон перезаписывается целиком и отдельная очистка не нужна
+        matrix = []
+        row_totals = []
+        column_sums = [0] * len(STATUS_INDEX)
+        empty_counts = [None] * len(STATUS_INDEX)
+        filled_cells = 0
         
-        for row, sku in enumerate(sku_list, start=5):
-            counts = sku_counts.get(sku, {})
+        for sku in sku_list:
+            row_values = []
             row_total = 0  # Сумма для текущей строки
-            
-            # Записываем данные по статусам
-            for status, col in STATUS_TO_COLUMN.items():
-                if status in counts:
-                    quantity = counts[status]
-                    updates.append({
-                        'range': f"{col}{row}",
-                        'values': [[quantity]]
-                    })
-                    column_sums[col] += quantity
-                    row_total += quantity
-            
-            # Добавляем сумму в столбец T
-            if row_total > 0:
-                updates.append({
-                    'range': f"T{row}",
-                    'values': [[row_total]]
-                })
+            for i, quantity in enumerate(sku_counts.get(sku, empty_counts)):
+                if quantity is None:
+                    row_values.append("")
+                    continue
+                row_values.append(quantity)
+                column_sums[i] += quantity
+                row_total += quantity
+                filled_cells += 1
+            matrix.append(row_values)
+            # Сумма в столбец T только если она не равна 0
+            row_totals.append([row_total] if row_total > 0 else [""])
         
-        # Добавляем суммы в 3 строку только если они не равны 0
-        for col, total in column_sums.items():
-            if total != 0:
-                updates.append({
-                    'range': f"{col}3",
-                    'values': [[total]]
-                })
+        # Суммы в 3 строку только если они не равны 0
+        sums_row = [total if total != 0 else "" for total in column_sums]
         
-        # Применяем обновления
-        if updates:
-            self.sheet.batch_update(updates)
-            print(f"Обновлено {len(updates)} ячеек")
-            print(f"Суммы в 3 строке: W3={column_sums['W']}, X3={column_sums['X']}, Y3={column_sums['Y']}, Z3={column_sums['Z']}, AA3={column_sums['AA']}, AB3={column_sums['AB']}")
+        # Три прямоугольных диапазона одним запросом
+        self.sheet.batch_update([
+            {'range': f"W5:AB{last_row}", 'values': matrix},
+            {'range': f"T5:T{last_row}", 'values': row_totals},
+            {'range': "W3:AB3", 'values': [sums_row]}
+        ])
+        if filled_cells:
+            print(f"Обновлено {filled_cells} ячеек")
+            sums = dict(zip(STATUS_TO_COLUMN.values(), column_sums))
+            print(f"Суммы в 3 строке: W3={sums['W']}, X3={sums['X']}, Y3={sums['Y']}, Z3={sums['Z']}, AA3={sums['AA']}, AB3={sums['AB']}")
         else:
             print("Нет данных для обновления")
     
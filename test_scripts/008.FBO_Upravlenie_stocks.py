@@ -1,9 +1,34 @@
-import requests
+import asyncio
+import functools
+import os
+import random
+from functools import cached_property
+from pathlib import Path
+from types import MappingProxyType
+import aiohttp
 import gspread
-from oauth2client.service_account import ServiceAccountCredentials
+import orjson
+from google.oauth2.service_account import Credentials
+from googleapiclient.discovery import build
 from typing import List, Dict, Optional
-import time
-from collections import defaultdict
+
+
+API_CONFIG_PATH = "(1)API.txt"
+
+
+@functools.lru_cache(maxsize=8)
+def _load_config_lines(path: str, mtime: float) -> tuple:
+    # Непустые строки конфига; кэш по (путь, mtime) — файл перечитывается только после изменения
+    return tuple(line.strip() for line in Path(path).read_text(encoding="utf-8").splitlines() if line.strip())
+
+
+# Заглушка для SKU без данных от API (общая, чтобы не создавать {} на каждый промах)
+_EMPTY_ITEM: dict = {}
+
+
+def _turnover_grade_cells(grade_ru: Dict[str, str], descriptions: Dict[str, str]) -> Dict[str, tuple]:
+    # Код статуса → (название, описание) для ячеек AG, AH
+    return {code: (ru, descriptions.get(code) or "") for code, ru in grade_ru.items()}
 
 
 class OzonAnalyticsStocks:
@@ -45,13 +70,24 @@ class OzonAnalyticsStocks:
         "UNSPECIFIED": "Нет данных",
     }
 
-    # Диапазон очистки данных — записываем в AD..AI
-    SHEET_RANGE_CLEAR = "AD5:AI1000"
+    # Код статуса → готовые ячейки (AG, AH): один поиск на строку вместо двух методов
+    TURNOVER_GRADE_CELLS = _turnover_grade_cells(TURNOVER_GRADE_RU, TURNOVER_GRADE_DESCRIPTIONS)
+
+    # Область данных AD..AI: строки с 5-й по SHEET_CLEAR_LAST_ROW перезаписываются целиком
+    SHEET_CLEAR_LAST_ROW = 1000
+
+    # Запросы остатков: размер пачки, одновременно в полёте и не чаще N стартов в секунду
+    STOCKS_BATCH_SIZE = 50
+    MAX_CONCURRENT_REQUESTS = 10
+    REQUESTS_PER_SECOND = 5
+    # Повторы при 429/5xx: число попыток и потолок паузы между ними (сек)
+    STOCKS_MAX_RETRIES = 5
+    STOCKS_MAX_BACKOFF = 30
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
 
     def __init__(self, credentials_path: str = "credentials.json"):
         # Читаем конфиг
-        with open("(1)API.txt", "r", encoding="utf-8") as f:
-            lines = [line.strip() for line in f.readlines() if line.strip()]
+        lines = _load_config_lines(API_CONFIG_PATH, os.path.getmtime(API_CONFIG_PATH))
         if len(lines) < 4:
             raise ValueError(
                 "Файл (1)API.txt должен содержать 4 строки (client_id, api_key, spreadsheet_id, sheet_name)"
@@ -63,13 +99,14 @@ class OzonAnalyticsStocks:
         self.sheet_name = lines[3]
 
         self.base_url = "https://api-seller.ozon.ru"
-        self.headers = {
+        # неизменяемые заголовки: передаются сессии один раз, случайно изменить их нельзя
+        self.headers = MappingProxyType({
             "Client-Id": self.client_id,
             "Api-Key": self.api_key,
             "Content-Type": "application/json",
-        }
+        })
 
-        self.gc = self._init_google_sheets(credentials_path)
+        self.gc, self.service = self._init_google_sheets(credentials_path)
 
     # -------------------------------
     # Infrastructure / utils
@@ -80,8 +117,18 @@ class OzonAnalyticsStocks:
             "https://www.googleapis.com/auth/spreadsheets",
             "https://www.googleapis.com/auth/drive",
         ]
-        creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_path, scope)
-        return gspread.authorize(creds)
+        creds = Credentials.from_service_account_file(credentials_path, scopes=scope)
+        # gspread — для чтения; запись идёт напрямую через Sheets v4 без обёрток gspread
+        return gspread.authorize(creds), build("sheets", "v4", credentials=creds, cache_discovery=False)
+
+    # Таблица и лист открываются один раз за процесс (open_by_key/worksheet — это запросы к API)
+    @cached_property
+    def sh(self) -> gspread.Spreadsheet:
+        return self.gc.open_by_key(self.spreadsheet_id)
+
+    @cached_property
+    def ws(self) -> gspread.Worksheet:
+        return self.sh.worksheet(self.sheet_name)
 
     @staticmethod
     def _as_int_or_none(v) -> Optional[int]:
@@ -101,121 +148,167 @@ class OzonAnalyticsStocks:
         except (TypeError, ValueError):
             return None
 
-    @staticmethod
-    def _to_sheet_cell(value) -> str:
-        # None -> пустая ячейка, иначе строка
-        return "" if value is None else str(value)
-
-    @staticmethod
-    def _to_sheet_cell_blank_if_zero(value: Optional[int]) -> str:
-        # Для "Возвраты поставщику": 0 и None -> пусто
-        if value is None or value == 0:
-            return ""
-        return str(value)
-
     # -------------------------------
     # Data fetching
     # -------------------------------
 
     def get_sku_list_from_sheet(self) -> List[str]:
-        sh = self.gc.open_by_key(self.spreadsheet_id)
-        worksheet = sh.worksheet(self.sheet_name)
-        # SKU из колонки B (2), начиная с 5-й строки
-        skus = [str(sku).strip() for sku in worksheet.col_values(2)[4:] if str(sku).strip()]
+        # SKU из колонки B (2), начиная с 5-й строки: сразу нужный диапазон, без строк шапки
+        column_b = self.ws.get(
+            "B5:B", major_dimension="COLUMNS", value_render_option="UNFORMATTED_VALUE"
+        )
+        skus = [s for s in (str(sku).strip() for sku in (column_b[0] if column_b else [])) if s]
         print(f"Получено {len(skus)} SKU из таблицы")
         return skus
 
     def get_stocks_data(self, skus: List[str]) -> Dict:
-        batch_size = 50
-        all_items = []
-
-        for i in range(0, len(skus), batch_size):
-            batch = skus[i : i + batch_size]
+        return asyncio.run(self._get_stocks_data_async(skus))
+
+    async def _get_stocks_data_async(self, skus: List[str]) -> Dict:
+        batch_size = self.STOCKS_BATCH_SIZE
+        url = f"{self.base_url}/v1/analytics/stocks"
+        timeout = aiohttp.ClientTimeout(total=30)
+        sem = asyncio.Semaphore(self.MAX_CONCURRENT_REQUESTS)
+
+        # Адаптивный ограничитель частоты: старты запросов разносятся на interval.
+        # На 429 интервал удваивается, на каждый успешный ответ плавно возвращается к базовому
+        base_interval = 1 / self.REQUESTS_PER_SECOND
+        interval = base_interval
+        rate_lock = asyncio.Lock()
+        loop = asyncio.get_running_loop()
+        next_start = loop.time()
+
+        async def throttle():
+            nonlocal next_start
+            async with rate_lock:
+                now = loop.time()
+                if next_start > now:
+                    await asyncio.sleep(next_start - now)
+                next_start = max(now, next_start) + interval
+
+        def on_throttled():
+            nonlocal interval
+            interval = min(interval * 2, self.STOCKS_MAX_BACKOFF)
+
+        def on_success():
+            nonlocal interval
+            interval = max(base_interval, interval * 0.9)
+
+        async def fetch_batch(session: aiohttp.ClientSession, batch: List[str]) -> List[dict]:
             payload = {"skus": batch, "warehouse_ids": [], "limit": batch_size}
+            body = orjson.dumps(payload)
+            for attempt in range(self.STOCKS_MAX_RETRIES + 1):
+                async with sem:
+                    await throttle()
+                    try:
+                        # Не печатаем список SKU пачки
+                        async with session.post(url, data=body, timeout=timeout) as response:
+                            if response.status in self.RETRY_STATUSES and attempt < self.STOCKS_MAX_RETRIES:
+                                if response.status == 429:
+                                    on_throttled()
+                                retry_after = response.headers.get("Retry-After", "")
+                                delay = float(retry_after) if retry_after.isdigit() else None
+                            else:
+                                response.raise_for_status()
+                                data = orjson.loads(await response.read())
+                                on_success()
+                                return data.get("items", [])
+                    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                        print(f"Ошибка при запросе: {e}")
+                        return []
+                # пауза вне семафора, чтобы не держать слот; экспонента с джиттером
+                if delay is None:
+                    delay = min(self.STOCKS_MAX_BACKOFF, 2 ** attempt) + random.uniform(0, 0.5)
+                await asyncio.sleep(delay)
+            return []
+
+        connector = aiohttp.TCPConnector(limit=self.MAX_CONCURRENT_REQUESTS, ttl_dns_cache=300)
+        async with aiohttp.ClientSession(headers=self.headers, connector=connector) as session:
+            # gather сохраняет порядок пачек
+            results = await asyncio.gather(
+                *(fetch_batch(session, skus[i : i + batch_size]) for i in range(0, len(skus), batch_size))
+            )
 
-            try:
-                # Не печатаем список SKU пачки
-                response = requests.post(
-                    f"{self.base_url}/v1/analytics/stocks",
-                    headers=self.headers,
-                    json=payload,
-                    timeout=30,
-                )
-                response.raise_for_status()
-                data = response.json()
-                all_items.extend(data.get("items", []))
-            except requests.exceptions.RequestException as e:
-                print(f"Ошибка при запросе: {e}")
-                continue
-
-            time.sleep(1)
-
+        all_items = []
+        for items in results:
+            all_items.extend(items)
         return {"items": all_items}
 
     # -------------------------------
     # Transform
     # -------------------------------
 
-    def turnover_grade_ru(self, grade: Optional[str]) -> Optional[str]:
-        return self.TURNOVER_GRADE_RU.get(grade) if grade else None
-
-    def describe_turnover_grade(self, grade: Optional[str]) -> Optional[str]:
-        return self.TURNOVER_GRADE_DESCRIPTIONS.get(grade) if grade else None
-
     def build_export_rows(self, skus: List[str], items: List[dict]) -> List[List[str]]:
-        # репрезентативная запись + сумма возвратов по SKU
-        rep_item: Dict[str, dict] = {}
-        returns_sum: Dict[str, Optional[int]] = defaultdict(lambda: None)
+        # В горячих циклах — только локальные имена (без поиска атрибутов на каждой итерации)
+        as_int = self._as_int_or_none
+        as_float = self._as_float_or_none
+        grade_cells = self.TURNOVER_GRADE_CELLS.get
+        no_grade = ("", "")
+
+        # SKU → [репрезентативная запись, сумма возвратов или None]: один поиск в словаре на item
+        agg: Dict[str, list] = {}
 
         for it in items:
-            sku_str = str(it.get("sku")) if it.get("sku") is not None else None
+            sku = it.get("sku")
+            if sku is None:
+                continue
+            sku_str = str(sku)
             if not sku_str:
                 continue
 
-            if sku_str not in rep_item:
-                rep_item[sku_str] = it
+            entry = agg.get(sku_str)
+            if entry is None:
+                agg[sku_str] = entry = [it, None]
 
-            val = self._as_int_or_none(it.get("return_to_seller_stock_count"))
+            val = as_int(it.get("return_to_seller_stock_count"))
             if val is not None:
-                if returns_sum[sku_str] is None:
-                    returns_sum[sku_str] = val
-                else:
-                    returns_sum[sku_str] += val
+                entry[1] = val if entry[1] is None else entry[1] + val
 
         export_rows: List[List[str]] = []
+        append = export_rows.append
 
-        for sku in skus:
-            base = rep_item.get(sku, {})
-
-            days_without_sales = self._as_int_or_none(base.get("days_without_sales"))
-            idc = self._as_int_or_none(base.get("idc"))
-            ads = self._as_float_or_none(base.get("ads"))
-            turnover_code = base.get("turnover_grade")
-            grade_ru = self.turnover_grade_ru(turnover_code)
-            grade_desc = self.describe_turnover_grade(turnover_code)
-            rts_sum = returns_sum.get(sku)
-
-            # AD, AE — 0 показываем как "0"
-            ad_days = self._to_sheet_cell(days_without_sales)
-            ae_idc = self._to_sheet_cell(idc)
+        # Значения ADS и целые счётчики сильно повторяются — форматируем каждое один раз
+        ads_cells: Dict[float, str] = {0.0: "0"}
+        int_cells: Dict[Optional[int], str] = {None: ""}
 
-            # AF — Возвраты поставщику: 0 скрываем
-            af_returns = self._to_sheet_cell_blank_if_zero(rts_sum)
+        for sku in skus:
+            entry = agg.get(sku)
+            if entry is None:
+                base, rts_sum = _EMPTY_ITEM, None
+            else:
+                base, rts_sum = entry
 
-            # AG — Статус (код) на русском (кратко)
-            ag_grade_ru = self._to_sheet_cell(grade_ru)
+            days_without_sales = as_int(base.get("days_without_sales"))
+            idc = as_int(base.get("idc"))
+            ads = as_float(base.get("ads"))
 
-            # AH — Только описание
-            ah_grade_desc = self._to_sheet_cell(grade_desc)
+            turnover_code = base.get("turnover_grade")
+            cells = grade_cells(turnover_code, no_grade) if turnover_code else no_grade
 
             # AI — ADS: округляем до 2 знаков, но 0.00 → "0"
             if ads is None:
                 ai_ads = ""
             else:
                 rounded = round(ads, 2)
-                ai_ads = "0" if rounded == 0 else f"{rounded:.2f}"
-
-            export_rows.append([ad_days, ae_idc, af_returns, ag_grade_ru, ah_grade_desc, ai_ads])
+                ai_ads = ads_cells.get(rounded)
+                if ai_ads is None:
+                    ai_ads = ads_cells[rounded] = "0" if rounded == 0 else f"{rounded:.2f}"
+
+            ad_days = int_cells.get(days_without_sales)
+            if ad_days is None:
+                ad_days = int_cells[days_without_sales] = str(days_without_sales)
+            ae_idc = int_cells.get(idc)
+            if ae_idc is None:
+                ae_idc = int_cells[idc] = str(idc)
+
+            append([
+                ad_days,  # AD — 0 показываем как "0"
+                ae_idc,  # AE — 0 показываем как "0"
+                "" if not rts_sum else str(rts_sum),  # AF — Возвраты поставщику: 0 скрываем
+                cells[0],  # AG — Статус (код) на русском (кратко)
+                cells[1],  # AH — Только описание
+                ai_ads,
+            ])
 
         return export_rows
 
@@ -224,15 +317,19 @@ class OzonAnalyticsStocks:
     # -------------------------------
 
     def export_data_to_sheet(self, data: List[List[str]]):
-        sh = self.gc.open_by_key(self.spreadsheet_id)
-        worksheet = sh.worksheet(self.sheet_name)
-
-        # Очищаем AD..AI и заливаем строки — заголовки НЕ трогаем
-        worksheet.batch_clear([self.SHEET_RANGE_CLEAR])
-
-        if data:
-            bottom_row = 4 + len(data)
-            worksheet.update(data, f"AD5:AI{bottom_row}")
+        # Очистка и запись одним запросом: хвост до SHEET_CLEAR_LAST_ROW добиваем пустыми строками,
+        # заголовки НЕ трогаем
+        padding = max(0, self.SHEET_CLEAR_LAST_ROW - 4 - len(data))
+        values = data + [[""] * 6 for _ in range(padding)]
+        if values:
+            bottom_row = 4 + len(values)
+            # RAW: значения уже готовые строки, серверный разбор как формул/чисел не нужен
+            self.service.spreadsheets().values().update(
+                spreadsheetId=self.spreadsheet_id,
+                range=f"'{self.sheet_name}'!AD5:AI{bottom_row}",
+                valueInputOption="RAW",
+                body={"values": values},
+            ).execute()
 
         print(f"Экспортировано {len(data)} строк в таблицу")
 
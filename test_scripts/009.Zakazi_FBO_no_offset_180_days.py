@@ -1,11 +1,16 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta, timezone
 import logging
+import sys
 import pytz
 import time
-from collections import defaultdict
+import numpy as np
+import pandas as pd
 from dateutil.relativedelta import relativedelta
 
 # Настройка логирования
@@ -26,48 +31,83 @@ def read_api_credentials(file_path):
         logging.error(f"Ошибка при чтении API: {e}")
         raise
 
+# Сколько месячных диапазонов запрашивать одновременно
+MONTH_WORKERS = 6
+
 class OzonAPI:
     def __init__(self, client_id, api_key):
         self.client_id = client_id
         self.api_key = api_key
         self.base_url = "https://api-seller.ozon.ru"
-
-    def get_fbo_posting_list(self, data):
-        url = f"{self.base_url}/v2/posting/fbo/list"
-        headers = {
+        # Одна сессия на все потоки: keep-alive и пул соединений под параллельные месяцы
+        self.session = requests.Session()
+        # Пауза только при ответе 429/5xx: urllib3 ждет Retry-After (или экспоненциально) и повторяет запрос
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=MONTH_WORKERS,
+            max_retries=Retry(
+                total=5,
+                backoff_factor=1,
+                backoff_max=30,
+                # случайная добавка к паузе, чтобы повторы разных запросов не совпадали по времени
+                backoff_jitter=1,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["POST"],
+            ),
+        ))
+        self.session.headers.update({
             "Client-Id": self.client_id,
             "Api-Key": self.api_key,
             "Content-Type": "application/json"
-        }
+        })
+
+    def get_fbo_posting_list(self, data):
+        url = f"{self.base_url}/v2/posting/fbo/list"
         try:
-            response = requests.post(url, headers=headers, json=data)
+            response = self.session.post(url, json=data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
+            # повторы уже исчерпаны сессией; молча обрывать пагинацию нельзя — данные за период выйдут неполными
             logging.error(f"Ошибка API: {e}")
-            return None
-
-def convert_to_moscow_date(utc_time_str):
-    try:
-        utc_time = datetime.strptime(utc_time_str, '%Y-%m-%dT%H:%M:%S.%fZ').replace(tzinfo=timezone.utc)
-        return utc_time.astimezone(pytz.timezone('Europe/Moscow'))
-    except Exception as e:
-        logging.error(f"Конверт времени: {e}")
-        return None
-
-def prepare_data_for_sheet(all_postings, days=28):
+            raise
+
+DAY_NS = 86_400 * 10**9
+
+def postings_frame(all_postings):
+    """
+    Товары всех отправлений одной таблицей: offer_id, in_process_at, quantity, status и date (по Москве).
+    Даты разбираются одним векторным вызовом, а не strptime на каждое отправление.
+    """
+    df = pd.DataFrame.from_records(
+        [
+            (product.get('offer_id', ''), posting.get('in_process_at', ''), product.get('quantity', 0), posting.get('status'))
+            for posting in all_postings
+            for product in posting.get('products', [])
+        ],
+        columns=['offer_id', 'in_process_at', 'quantity', 'status']
+    )
+    # Нераспознанная дата → NaT, такие строки не попадают ни в один период
+    df['date'] = pd.to_datetime(
+        df['in_process_at'], format='%Y-%m-%dT%H:%M:%S.%fZ', utc=True, errors='coerce'
+    ).dt.tz_convert('Europe/Moscow')
+    unparsed = int(df['date'].isna().sum())
+    if unparsed:
+        logging.error(f"Конверт времени: не распознано дат — {unparsed}")
+    return df
+
+def prepare_data_for_sheet(df, days=28):
     today = datetime.now(timezone.utc)
-    order_counts = defaultdict(lambda: defaultdict(int))
     date_headers = [(today - timedelta(days=i)).strftime('%d.%m') for i in reversed(range(days))]
     date_strings = [(today - timedelta(days=i)).strftime('%d.%m.%Y') for i in reversed(range(days))]
 
-    for posting in all_postings:
-        posting_date_utc = convert_to_moscow_date(posting.get('in_process_at', ''))
-        if not posting_date_utc:
-            continue
-        posting_date_str = posting_date_utc.strftime('%d.%m.%Y')
-        for product in posting.get('products', []):
-            order_counts[product.get('offer_id', '')][posting_date_str] += product.get('quantity', 0)
+    # offer_id × день: сумма количества; дни с NaT (нераспознанная дата) pivot_table отбрасывает
+    if df.empty:
+        return date_headers, date_strings, pd.DataFrame(columns=date_strings, dtype='int64')
+    order_counts = df.pivot_table(
+        index='offer_id', columns=df['date'].dt.strftime('%d.%m.%Y'),
+        values='quantity', aggfunc='sum', fill_value=0
+    ).reindex(columns=date_strings, fill_value=0)
     return date_headers, date_strings, order_counts
 
 def get_month_ranges(start_date, end_date):
@@ -90,19 +130,16 @@ def main():
         client = gspread.authorize(creds)
         sheet = client.open_by_key(sheet_id).worksheet(sheet_name)
 
-        # Очистка
-        sheet.batch_clear(['AQ3:BR', 'CW5:CW', 'CY5:CY', 'DA5:DA', 'DC5:DC', 'DE5:DE',
-                           'DN5:DN', 'DP5:DP', 'DY5:DY', 'DZ5:DZ', 'EA5:EA', 'EB5:EB', 'DL5:DL'])
-
         today = datetime.now(timezone.utc)
         start_date = (today - timedelta(days=170)).replace(tzinfo=timezone.utc)
         end_date = today.replace(tzinfo=timezone.utc)
 
-        all_postings = []
         limit = 1000
         month_ranges = get_month_ranges(start_date, end_date)
 
-        for month_start, month_end in month_ranges:
+        def fetch_month(month_start, month_end):
+            """Все отправления одного месячного диапазона (постранично)"""
+            postings_of_month = []
             offset = 0
             while True:
                 data = {
@@ -122,31 +159,40 @@ def main():
                 postings = response['result'] if isinstance(response['result'], list) else response['result'].get('postings', [])
                 if not postings:
                     break
-                all_postings.extend(postings)
+                postings_of_month.extend(postings)
                 offset += limit
                 if len(postings) < limit:
                     break
-                time.sleep(0.5)
+            return postings_of_month
+
+        # Месяцы независимы — запрашиваем параллельно; map сохраняет порядок месяцев
+        with ThreadPoolExecutor(max_workers=MONTH_WORKERS) as executor:
+            all_postings = [
+                posting
+                for postings_of_month in executor.map(lambda r: fetch_month(*r), month_ranges)
+                for posting in postings_of_month
+            ]
 
         if not all_postings:
             return
 
-        date_headers, date_strings, order_counts = prepare_data_for_sheet(all_postings)
+        df = postings_frame(all_postings)
+        date_headers, date_strings, order_counts = prepare_data_for_sheet(df)
         skus = sheet.col_values(4)[4:]
 
         data_to_write = [{'range': 'AQ4:BR4', 'values': [date_headers]}]
 
-        all_rows = []
-        for idx, sku in enumerate(skus, start=5):
-            if not sku:
-                continue
-            row_data = [order_counts[sku].get(date_str, 0) for date_str in date_strings]
-            data_to_write.append({'range': f'AQ{idx}:BR{idx}', 'values': [row_data]})
-            all_rows.append(row_data)
-
-        if all_rows:
-            column_sums = [sum(col) for col in zip(*all_rows)]
-            data_to_write.append({'range': 'AQ3:BR3', 'values': [column_sums]})
+        # Вся область AQ5:BR одной матрицей; строки без SKU — пустые
+        sku_rows = [sku for sku in skus if sku]
+        if sku_rows:
+            matrix = order_counts.reindex(index=sku_rows, fill_value=0).astype('int64')
+            rows_by_sku = iter(matrix.values.tolist())
+            empty_row = [''] * len(date_strings)
+            data_to_write.append({
+                'range': f'AQ5:BR{len(skus) + 4}',
+                'values': [next(rows_by_sku) if sku else empty_row for sku in skus]
+            })
+            data_to_write.append({'range': 'AQ3:BR3', 'values': [matrix.sum().tolist()]})
 
         moscow_tz = pytz.timezone('Europe/Moscow')
         today_moscow = datetime.now(moscow_tz).replace(hour=0, minute=0, second=0, microsecond=0)
@@ -155,51 +201,52 @@ def main():
         delivered_periods = {'DY': 30, 'DZ': 60, 'EA': 90, 'EB': 180}
         cancellation_periods = {'DN': 7, 'DP': 28}
 
-        period_counts = {col: defaultdict(int) for col in periods}
-        delivered_counts = {col: defaultdict(int) for col in delivered_periods}
-        cancellation_counts = {col: defaultdict(int) for col in cancellation_periods}
-
-        for posting in all_postings:
-            posting_date = convert_to_moscow_date(posting.get('in_process_at', ''))
-            if not posting_date:
-                continue
-
-            for col, days in periods.items():
-                if today_moscow - timedelta(days=days - 1) <= posting_date <= today_moscow + timedelta(days=1):
-                    for product in posting.get('products', []):
-                        period_counts[col][product['offer_id']] += product['quantity']
-
-            if posting.get('status') == 'delivered':
-                for col, days in delivered_periods.items():
-                    if today_moscow - timedelta(days=days - 1) <= posting_date <= today_moscow + timedelta(days=1):
-                        for product in posting.get('products', []):
-                            delivered_counts[col][product['offer_id']] += product['quantity']
-
-            if posting.get('status') == 'cancelled':
-                for col, days in cancellation_periods.items():
-                    if today_moscow - timedelta(days=days - 1) <= posting_date <= today_moscow + timedelta(days=1):
-                        for product in posting.get('products', []):
-                            cancellation_counts[col][product['offer_id']] += product['quantity']
-
-        for idx, sku in enumerate(skus, start=5):
-            if not sku:
-                continue
-            for col in periods:
-                data_to_write.append({'range': f'{col}{idx}', 'values': [[period_counts[col].get(sku, 0)]]})
-            for col in cancellation_periods:
-                data_to_write.append({'range': f'{col}{idx}', 'values': [[cancellation_counts[col].get(sku, 0)]]})
-            for col in delivered_periods:
-                data_to_write.append({'range': f'{col}{idx}', 'values': [[delivered_counts[col].get(sku, 0)]]})
+        # Даты как int64 наносекунды эпохи (NaT — минимальное int64, ни в один период не попадает)
+        ts = pd.DatetimeIndex(df['date']).asi8
+        today_ns = pd.Timestamp(today_moscow).value
+        in_window = ts <= today_ns + DAY_NS
+        codes, offer_ids = pd.factorize(df['offer_id'].fillna(''))
+        quantity = pd.to_numeric(df['quantity'], errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        status = df['status'].to_numpy()
+
+        def window_sums(period_days, row_mask):
+            """{столбец: {offer_id: сумма}} сразу для всех периодов: маски периодов — одна матрица через broadcasting"""
+            cols = list(period_days)
+            starts = today_ns - (np.array([period_days[c] for c in cols], dtype=np.int64) - 1) * DAY_NS
+            masks = (ts[:, None] >= starts[None, :]) & (in_window & row_mask)[:, None]
+            weights = masks * quantity[:, None]
+            return {
+                col: dict(zip(offer_ids, np.bincount(codes, weights=weights[:, j], minlength=len(offer_ids)).astype(np.int64).tolist()))
+                for j, col in enumerate(cols)
+            }
+
+        period_counts = window_sums(periods, np.ones(len(df), dtype=bool))
+        delivered_counts = window_sums(delivered_periods, status == 'delivered')
+        cancellation_counts = window_sums(cancellation_periods, status == 'cancelled')
+
+        # Один диапазон на столбец; строки без SKU остаются пустыми (столбцы очищены выше)
+        last_row = len(skus) + 4
+        for counts in (period_counts, cancellation_counts, delivered_counts):
+            for col, col_counts in counts.items():
+                data_to_write.append({
+                    'range': f'{col}5:{col}{last_row}',
+                    'values': [[col_counts.get(sku, 0) if sku else ''] for sku in skus]
+                })
 
         # Заменили %Y на %y для двухзначного года
         for col, days in delivered_periods.items():
             start_period = (today_moscow - timedelta(days=days - 1)).strftime('%d.%m.%y')
             data_to_write.append({'range': f'{col}3', 'values': [[start_period]]})
 
+        # Очистка — только когда все данные уже получены: при сбое выгрузки в таблице остаются прежние значения
+        sheet.batch_clear(['AQ3:BR', 'CW5:CW', 'CY5:CY', 'DA5:DA', 'DC5:DC', 'DE5:DE',
+                           'DN5:DN', 'DP5:DP', 'DY5:DY', 'DZ5:DZ', 'EA5:EA', 'EB5:EB', 'DL5:DL'])
         sheet.batch_update(data_to_write)
 
     except Exception as e:
         logging.error(f"Ошибка: {e}", exc_info=True)
+        # Ненулевой код, чтобы ALL_START засчитал запуск как неуспешный
+        sys.exit(1)
     finally:
         logging.info(f"Скрипт завершён за {time.time() - start_time:.2f} секунд")
 
@@ -1,8 +1,11 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime, timedelta, timezone
 import logging
+import sys
 import pytz
 import time
 from collections import defaultdict
@@ -26,21 +29,37 @@ class OzonAPI:
         self.client_id = client_id
         self.api_key = api_key
         self.base_url = "https://api-seller.ozon.ru"
-
-    def get_fbo_posting_list(self, data):
-        url = f"{self.base_url}/v2/posting/fbo/list"
-        headers = {
+        # Одна сессия: keep-alive между страницами; на 429/5xx urllib3 сам ждет (с учетом Retry-After) и повторяет
+        self.session = requests.Session()
+        self.session.mount("https://", HTTPAdapter(
+            pool_connections=2,
+            pool_maxsize=4,
+            max_retries=Retry(
+                total=5,
+                backoff_factor=1,
+                backoff_max=30,
+                # случайная добавка к паузе, чтобы повторы разных запросов не совпадали по времени
+                backoff_jitter=1,
+                status_forcelist=[429, 500, 502, 503, 504],
+                allowed_methods=["POST"],
+            ),
+        ))
+        self.session.headers.update({
             "Client-Id": self.client_id,
             "Api-Key": self.api_key,
             "Content-Type": "application/json"
-        }
+        })
+
+    def get_fbo_posting_list(self, data):
+        url = f"{self.base_url}/v2/posting/fbo/list"
         try:
-            response = requests.post(url, headers=headers, json=data)
+            response = self.session.post(url, json=data)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
+            # повторы уже исчерпаны сессией; молча обрывать пагинацию нельзя — данные за период выйдут неполными
             logging.error(f"Ошибка API: {e}")
-            return None
+            raise
 
 def get_last_year_month_range(month_offset):
     today = datetime.now(pytz.timezone('Europe/Moscow'))
@@ -69,14 +88,17 @@ def get_delivered_count_by_sku(api, start_dt, end_dt):
         response = api.get_fbo_posting_list(data)
         if not response:
             break
-        new_postings = response['result'] if isinstance(response['result'], list) else response['result'].get('postings', [])
+        result = response.get('result') or []
+        new_postings = result if isinstance(result, list) else result.get('postings', [])
         if not new_postings:
             break
         postings.extend(new_postings)
         offset += limit
-        if len(new_postings) < limit:
+        # v2 FBO отдает список без признака продолжения; если пришел has_next — верим ему,
+        # иначе короткая страница означает конец
+        has_next = result.get('has_next') if isinstance(result, dict) else None
+        if has_next is False or len(new_postings) < limit:
             break
-        time.sleep(0.5)
 
     counts = defaultdict(int)
     for posting in postings:
@@ -99,11 +121,6 @@ def main():
 
         skus = sheet.col_values(4)[4:]  # Столбец D начиная с 5 строки
 
-        # Очистка диапазонов перед записью данных
-        logging.info("Очистка старых данных из столбцов EL, EN, EP...")
-        clear_ranges = ['EL5:EL', 'EN5:EN', 'EP5:EP']
-        sheet.batch_clear(clear_ranges)
-
         data_to_write = []
 
         # Обновлённые столбцы: EL, EN, EP
@@ -140,12 +157,19 @@ def main():
             date_range_str = f"{start_dt.strftime('%d.%m.%y')} {end_dt.strftime('%d.%m.%y')}"
             data_to_write.append({'range': f'{col}3', 'values': [[date_range_str]]})
 
+        # Очистка — только когда все месяцы уже получены: при сбое выгрузки в таблице остаются прежние значения
+        logging.info("Очистка старых данных из столбцов EL, EN, EP...")
+        clear_ranges = ['EL5:EL', 'EN5:EN', 'EP5:EP']
+        sheet.batch_clear(clear_ranges)
+
         logging.info("Обновление Google Sheets...")
         sheet.batch_update(data_to_write)
         logging.info("Данные успешно обновлены в таблице.")
 
     except Exception as e:
         logging.error(f"Ошибка: {e}", exc_info=True)
+        # Ненулевой код, чтобы ALL_START засчитал запуск как неуспешный
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 import logging
+import sys
 from pytz import timezone as tz
-from collections import defaultdict
 import warnings
+import numpy as np
+import pandas as pd
 
 logging.basicConfig(
     level=logging.INFO,
@@ -16,6 +21,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 warnings.filterwarnings("ignore", category=DeprecationWarning, message="Parsing dates involving.*")
 
+DAY_NS = 86_400 * 10**9
+
 def read_api_keys(filename='(1)API.txt'):
     try:
         with open(filename, 'r', encoding='utf-8') as file:
@@ -44,6 +51,14 @@ def setup_google_sheets(sheet_id, target_sheet_name):
             worksheet = spreadsheet.add_worksheet(title=target_sheet_name, rows="1000", cols="100")
             logger.info(f"Создан новый лист '{target_sheet_name}'")
 
+        return worksheet
+    except Exception as e:
+        logger.error(f"Ошибка Google Sheets: {e}")
+        raise
+
+def clear_output_ranges(worksheet):
+    """Очистка столбцов скрипта; вызывается только после успешной выгрузки заказов"""
+    try:
         worksheet.batch_clear([
             "BT3:CU",
             "CX5:CX", "CZ5:CZ", "DB5:DB", "DD5:DD", "DF5:DF",
@@ -53,19 +68,40 @@ def setup_google_sheets(sheet_id, target_sheet_name):
             "EG5:EG", "EH5:EH", "EI5:EI", "EJ5:EJ"  # Добавлены новые столбцы для очистки
         ])
         logger.info("Очищены все диапазоны перед записью")
-
-        return worksheet
     except Exception as e:
         logger.error(f"Ошибка Google Sheets: {e}")
         raise
 
-def get_ozon_orders(client_id, api_key, since, to):
-    url = "https://api-seller.ozon.ru/v3/posting/fbs/list"
-    headers = {
+# Окна дат, которые выгружаются параллельно (по числу соединений в пуле сессии)
+FETCH_WORKERS = 4
+WINDOW_DAYS = 30
+
+def create_ozon_session(client_id, api_key):
+    """Сессия Ozon API: keep-alive между страницами; на 429/5xx urllib3 сам ждет (с учетом Retry-After) и повторяет"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=FETCH_WORKERS,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=1,
+            backoff_max=30,
+            # случайная добавка к паузе, чтобы повторы разных запросов не совпадали по времени
+            backoff_jitter=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+        ),
+    ))
+    session.headers.update({
         "Client-Id": client_id,
         "Api-Key": api_key,
         "Content-Type": "application/json"
-    }
+    })
+    return session
+
+def fetch_orders_window(session, since, to):
+    """Все отправления одного окна дат (постранично, по offset)"""
+    url = "https://api-seller.ozon.ru/v3/posting/fbs/list"
 
     all_orders = []
     offset = 0
@@ -81,7 +117,7 @@ def get_ozon_orders(client_id, api_key, since, to):
         }
 
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = session.post(url, json=payload)
             response.raise_for_status()
             data = response.json()
 
@@ -95,163 +131,169 @@ def get_ozon_orders(client_id, api_key, since, to):
                 break
 
         except Exception as e:
+            # повторы уже исчерпаны сессией; выход из цикла молча обрезал бы выгрузку
             logger.error(f"Ошибка API Ozon: {e}")
-            break
+            raise
 
     return all_orders
 
-def group_postings_by_datetime(orders, days=28):
-    moscow_tz = tz('Europe/Moscow')
-    utc_tz = timezone.utc
-
-    today = datetime.now(moscow_tz).replace(hour=0, minute=0, second=0, microsecond=0)
-    date_range = [(today - timedelta(days=i)).strftime('%d.%m') for i in reversed(range(days))]
-
-    datetime_postings = defaultdict(list)
-
-    for order in orders:
-        order_datetime = order.get('in_process_at', '')
-        products = order.get('products', [])
-
-        total_quantity = sum(int(product.get('quantity', 0)) for product in products)
-
-        try:
-            utc_time = datetime.fromisoformat(order_datetime.replace('Z', '+00:00')).replace(tzinfo=utc_tz)
-            moscow_time = utc_time.astimezone(moscow_tz)
-            date_key = moscow_time.strftime('%d.%m')
-
-            if date_key in date_range:
-                datetime_postings[date_key].append({
-                    'quantity': total_quantity,
-                    'full_date': moscow_time
-                })
-
-        except Exception as e:
-            logger.warning(f"Ошибка обработки даты: {order_datetime} — {e}")
-            continue
-
-    result_postings = {}
-    for date in date_range:
-        result_postings[date] = datetime_postings.get(date, [])
-
-    return date_range, result_postings
+def split_period(since, to, days=WINDOW_DAYS):
+    """Разбить [since, to] на окна по days дней, от новых к старым (как dir=DESC)"""
+    windows = []
+    end = to
+    while end > since:
+        start = max(since, end - timedelta(days=days))
+        windows.append((start, end))
+        end = start
+    return windows
+
+def get_ozon_orders(session, since, to):
+    """
+    Заказы FBS за период [since, to] (datetime в UTC).
+    Ozon не отдает общее число отправлений, поэтому параллелятся не страницы, а окна дат:
+    каждое окно листается по offset в своем потоке.
+    """
+    windows = split_period(since, to)
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        results = executor.map(
+            lambda window: fetch_orders_window(session, window[0].isoformat(), window[1].isoformat()),
+            windows
+        )
+        all_orders = []
+        seen = set()
+        for orders in results:
+            for order in orders:
+                # границы окон включаются в оба соседних окна
+                key = order.get('posting_number')
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                all_orders.append(order)
+    return all_orders
 
-def map_offer_id_to_dates(orders):
+def enrich_orders(orders):
+    """
+    Один разбор in_process_at на заказ: '_mtime' — время по Москве, '_date_key' — 'дд.мм'.
+    Если дату разобрать не удалось, оба поля None и заказ пропускается всеми агрегациями.
+    """
     moscow_tz = tz('Europe/Moscow')
     utc_tz = timezone.utc
-    offer_map = defaultdict(list)
-
     for order in orders:
         order_datetime = order.get('in_process_at', '')
-        products = order.get('products', [])
-        try:
-            utc_time = datetime.fromisoformat(order_datetime.replace('Z', '+00:00')).replace(tzinfo=utc_tz)
-            moscow_time = utc_time.astimezone(moscow_tz)
-            date_key = moscow_time.strftime('%d.%m')
-
-            for product in products:
-                offer_id = product.get('offer_id')
-                quantity = int(product.get('quantity', 0))
-                if offer_id:
-                    offer_map[offer_id].append({'date': date_key, 'quantity': quantity})
-        except Exception as e:
-            logger.warning(f"Ошибка обработки offer_id: {e}")
-            continue
-    return offer_map
-
-def get_period_quantities(orders, days):
-    moscow_tz = tz('Europe/Moscow')
-    now = datetime.now(moscow_tz).replace(hour=0, minute=0, second=0, microsecond=0)
-    start_date = now - timedelta(days=days - 1)
-
-    offer_totals = defaultdict(int)
-
-    for order in orders:
         try:
-            utc_time = datetime.fromisoformat(order['in_process_at'].replace('Z', '+00:00')).replace(tzinfo=timezone.utc)
+            # fromisoformat (Python 3.11+) сам понимает суффикс 'Z'
+            utc_time = datetime.fromisoformat(order_datetime).replace(tzinfo=utc_tz)
             moscow_time = utc_time.astimezone(moscow_tz)
-
-            if start_date <= moscow_time <= now + timedelta(days=1):
-                for product in order.get('products', []):
-                    offer_id = product.get('offer_id')
-                    quantity = int(product.get('quantity', 0))
-                    if offer_id:
-                        offer_totals[offer_id] += quantity
+            order['_mtime'] = moscow_time
+            # то же, что strftime('%d.%m'), без разбора шаблона на каждый заказ
+            order['_date_key'] = f"{moscow_time.day:02d}.{moscow_time.month:02d}"
         except Exception as e:
-            logger.warning(f"Ошибка при агрегации за {days} дней: {e}")
-
-    return offer_totals
-
-def get_cancellations_by_period(orders, days):
+            logger.warning(f"Ошибка обработки даты: {order_datetime} — {e}")
+            order['_mtime'] = order['_date_key'] = None
+    return orders
+
+def orders_frame(orders):
+    """
+    Товары всех заказов одной таблицей: offer_id, quantity, status, ts (момент заказа, нс от epoch) и date_key ('дд.мм').
+    Заказы без разобранной даты отбрасываются; нечисловое количество считается нулем.
+    """
+    df = pd.DataFrame.from_records(
+        [
+            (product.get('offer_id') or '', product.get('quantity', 0), order.get('status'), order['_mtime'], order['_date_key'])
+            for order in orders
+            if order['_mtime'] is not None
+            for product in order.get('products', [])
+        ],
+        columns=['offer_id', 'quantity', 'status', 'mtime', 'date_key']
+    )
+    df['quantity'] = pd.to_numeric(df['quantity'], errors='coerce').fillna(0).astype(np.int64)
+    df['ts'] = pd.DatetimeIndex(pd.to_datetime(df['mtime'], utc=True)).asi8
+    return df.drop(columns='mtime')
+
+def group_postings_by_datetime(df, days=28):
+    """Суммарное количество товаров в заказах по дням ('дд.мм') за последние days дней"""
     moscow_tz = tz('Europe/Moscow')
-    now = datetime.now(moscow_tz).replace(hour=0, minute=0, second=0, microsecond=0)
-    start_date = now - timedelta(days=days - 1)
-
-    cancel_map = defaultdict(int)
-
-    for order in orders:
-        if order.get("status") != "cancelled":
-            continue
-        try:
-            utc_time = datetime.fromisoformat(order['in_process_at'].replace('Z', '+00:00')).replace(tzinfo=timezone.utc)
-            moscow_time = utc_time.astimezone(moscow_tz)
-            if start_date <= moscow_time <= now + timedelta(days=1):
-                for product in order.get("products", []):
-                    offer_id = product.get("offer_id")
-                    quantity = int(product.get("quantity", 0))
-                    if offer_id:
-                        cancel_map[offer_id] += quantity
-        except Exception as e:
-            logger.warning(f"Ошибка при обработке отмены: {e}")
-            continue
 
-    return cancel_map
+    today = datetime.now(moscow_tz).replace(hour=0, minute=0, second=0, microsecond=0)
+    date_range = [(today - timedelta(days=i)).strftime('%d.%m') for i in reversed(range(days))]
 
-def get_delivered_by_period(orders, days):
+    date_totals = df.groupby('date_key')['quantity'].sum().reindex(date_range, fill_value=0)
+    return date_range, dict(zip(date_range, date_totals.tolist()))
+
+def map_offer_id_to_dates(df):
+    """offer_id × 'дд.мм' → количество (pivot); товары без offer_id не учитываются"""
+    with_offer = df[df['offer_id'] != '']
+    if with_offer.empty:
+        return pd.DataFrame(dtype='int64')
+    return with_offer.pivot_table(
+        index='offer_id', columns='date_key', values='quantity', aggfunc='sum', fill_value=0
+    )
+
+def aggregate_all(df, period_days, cancel_days, delivered_days):
+    """
+    Суммы по offer_id за периоды (все заказы, отмены, доставленные).
+    Период в d дней: от полуночи (сегодня - (d-1)) до полуночи завтрашнего дня по Москве.
+    Маски всех периодов группы — одна матрица через broadcasting, суммы — bincount по offer_id.
+    """
     moscow_tz = tz('Europe/Moscow')
     now = datetime.now(moscow_tz).replace(hour=0, minute=0, second=0, microsecond=0)
-    start_date = now - timedelta(days=days - 1)
-
-    delivered_map = defaultdict(int)
-
-    for order in orders:
-        if order.get("status") != "delivered":
-            continue
-        try:
-            utc_time = datetime.fromisoformat(order['in_process_at'].replace('Z', '+00:00')).replace(tzinfo=timezone.utc)
-            moscow_time = utc_time.astimezone(moscow_tz)
-            if start_date <= moscow_time <= now + timedelta(days=1):
-                for product in order.get("products", []):
-                    offer_id = product.get("offer_id")
-                    quantity = int(product.get("quantity", 0))
-                    if offer_id:
-                        delivered_map[offer_id] += quantity
-        except Exception as e:
-            logger.warning(f"Ошибка при обработке доставки: {e}")
-            continue
-
-    return delivered_map
+    now_ns = pd.Timestamp(now).value
+
+    df = df[df['offer_id'] != '']
+    ts = df['ts'].to_numpy()
+    quantity = df['quantity'].to_numpy()
+    status = df['status'].to_numpy()
+    codes, offer_ids = pd.factorize(df['offer_id'])
+    in_window = ts <= now_ns + DAY_NS
+
+    def window_sums(days_list, row_mask):
+        days_list = list(days_list)
+        starts = now_ns - (np.array(days_list, dtype=np.int64) - 1) * DAY_NS
+        masks = (ts[:, None] >= starts[None, :]) & (in_window & row_mask)[:, None]
+        weights = masks * quantity[:, None]
+        return {
+            days: dict(zip(offer_ids, np.bincount(codes, weights=weights[:, j], minlength=len(offer_ids)).astype(np.int64).tolist()))
+            for j, days in enumerate(days_list)
+        }
 
-def write_to_sheet(worksheet, dates, datetime_postings, offer_map, orders):
+    return (
+        window_sums(period_days, np.ones(len(df), dtype=bool)),
+        window_sums(cancel_days, status == 'cancelled'),
+        window_sums(delivered_days, status == 'delivered'),
+    )
+
+def split_columns(rows, first_col, count):
+    """
+    Строки диапазона (как из get/batch_get) → {буква столбца: значения}.
+    Как у col_values, хвост пустых ячеек каждого столбца отбрасывается.
+    """
+    first_index = gspread.utils.a1_to_rowcol(f"{first_col}1")[1]
+    columns = {}
+    for offset in range(count):
+        values = [row[offset] if offset < len(row) else '' for row in rows]
+        while values and values[-1] == '':
+            values.pop()
+        columns[gspread.utils.rowcol_to_a1(1, first_index + offset)[:-1]] = values
+    return columns
+
+def write_to_sheet(worksheet, dates, date_totals, offer_map, df):
     try:
         # 1. Записываем основные данные
-        sum_row = [sum(item['quantity'] for item in datetime_postings.get(date, [])) for date in dates]
-        worksheet.update(values=[sum_row], range_name='BT3')
-        worksheet.update(values=[dates], range_name='BT4')
+        # Все записи, включая суммы, копятся в payload и уходят одним batch_update
+        payload = []
 
-        offer_column = worksheet.col_values(4)[4:]
-        data_to_write = []
+        sum_row = [date_totals.get(date, 0) for date in dates]
+        payload.append({'range': 'BT3', 'values': [sum_row]})
+        payload.append({'range': 'BT4', 'values': [dates]})
 
-        for offer_id in offer_column:
-            row = []
-            for date in dates:
-                total = sum(entry['quantity'] for entry in offer_map.get(offer_id, []) if entry['date'] == date)
-                row.append(total)
-            data_to_write.append(row)
+        offer_column = worksheet.col_values(4)[4:]
+        # Матрица BT5 одним reindex: строки — SKU из столбца D (пустые и неизвестные — нули), столбцы — дни
+        data_to_write = offer_map.reindex(index=offer_column, columns=dates, fill_value=0).astype(np.int64).values.tolist()
 
         if data_to_write:
-            worksheet.update(values=data_to_write, range_name='BT5')
-            logger.info(f"Записано {len(data_to_write)} строк данных по offer_id")
+            payload.append({'range': 'BT5', 'values': data_to_write})
+            logger.info(f"Подготовлено {len(data_to_write)} строк данных по offer_id")
 
         # 2. Записываем агрегации по дням
         period_columns = {
@@ -261,25 +303,43 @@ def write_to_sheet(worksheet, dates, datetime_postings, offer_map, orders):
             60: 'DD',
             90: 'DF',
         }
+        cancel_periods = {
+            7: 'DO',
+            28: 'DQ'
+        }
+        delivered_periods = {
+            30: 'EC',
+            60: 'ED',
+            90: 'EE',
+            180: 'EF'
+        }
+        # Все периоды, отмены и доставки — за один проход по заказам
+        period_totals, cancel_totals, delivered_totals = aggregate_all(
+            df, period_columns, cancel_periods, delivered_periods
+        )
+
+        # Столбцы, которые пишет сам скрипт: суммы ниже берут их отсюда, а не перечитывают из таблицы
+        written_cols = {}
 
         for days, col_letter in period_columns.items():
-            totals = get_period_quantities(orders, days)
+            totals = period_totals[days]
             column_data = [[totals.get(offer_id, 0)] for offer_id in offer_column]
-            worksheet.update(values=column_data, range_name=f'{col_letter}5')
-            logger.info(f"Обновлён столбец {col_letter} — заказы за {days} дней")
+            payload.append({'range': f'{col_letter}5', 'values': column_data})
+            written_cols[col_letter] = [row[0] for row in column_data]
+            logger.info(f"Подготовлен столбец {col_letter} — заказы за {days} дней")
+
+        # 3. Помощники для сумм DG–DK и EG–EJ
+        # Вторые слагаемые — свои столбцы из written_cols, первые (CW, CY, …, DY..EB) — из таблицы
+        cached_cols = {}
 
-        # 3. Записываем суммы DG–DK
         def get_column(col_letter):
-            try:
-                return worksheet.col_values(gspread.utils.a1_to_rowcol(f"{col_letter}1")[1])[4:]
-            except:
-                return []
+            if col_letter in written_cols:
+                return written_cols[col_letter]
+            return cached_cols.get(col_letter, [])
 
         def safe_int(val):
-            try:
-                return int(val)
-            except:
-                return 0
+            # числа из UNFORMATTED_VALUE и written_cols; пустые ячейки ('') и текст — ноль
+            return int(val) if type(val) in (int, float) else 0
 
         def sum_columns(col1, col2):
             return [[safe_int(a) + safe_int(b)] for a, b in zip(col1, col2)]
@@ -292,45 +352,43 @@ def write_to_sheet(worksheet, dates, datetime_postings, offer_map, orders):
             'DK': ('DE', 'DF')
         }
 
-        for target_col, (left_col, right_col) in col_pairs.items():
-            left_vals = get_column(left_col)
-            right_vals = get_column(right_col)
-            summed = sum_columns(left_vals, right_vals)
-            worksheet.update(values=summed, range_name=f'{target_col}5')
-            logger.info(f"Обновлён столбец {target_col} = {left_col} + {right_col}")
-
         # 4. Записываем отмены
-        cancel_periods = {
-            7: 'DO',
-            28: 'DQ'
-        }
-
         for days, col_letter in cancel_periods.items():
-            cancellations = get_cancellations_by_period(orders, days)
+            cancellations = cancel_totals[days]
             cancel_data = [[cancellations.get(offer_id, 0)] for offer_id in offer_column]
-            worksheet.update(values=cancel_data, range_name=f"{col_letter}5")
-            logger.info(f"Обновлён столбец {col_letter} — отмены за {days} дней")
+            payload.append({'range': f"{col_letter}5", 'values': cancel_data})
+            logger.info(f"Подготовлен столбец {col_letter} — отмены за {days} дней")
 
         # 5. Записываем данные о доставке
-        delivered_periods = {
-            30: 'EC',
-            60: 'ED',
-            90: 'EE',
-            180: 'EF'
-        }
-
         for days, col_letter in delivered_periods.items():
-            delivered = get_delivered_by_period(orders, days)
+            delivered = delivered_totals[days]
             delivered_data = [[delivered.get(offer_id, 0)] for offer_id in offer_column]
-            worksheet.update(values=delivered_data, range_name=f"{col_letter}5")
-            logger.info(f"Обновлён столбец {col_letter} — доставлено за {days} дней")
+            payload.append({'range': f"{col_letter}5", 'values': delivered_data})
+            written_cols[col_letter] = [row[0] for row in delivered_data]
+            logger.info(f"Подготовлен столбец {col_letter} — доставлено за {days} дней")
 
         # 6. Записываем даты начала периодов
         today = datetime.now(tz('Europe/Moscow'))
         period_dates_row = [[(today - timedelta(days=d-1)).strftime('%d.%m.%y')] for d in delivered_periods]
-        worksheet.update(values=list(map(list, zip(*period_dates_row))), range_name="EC3:EF3")
+        payload.append({'range': "EC3:EF3", 'values': list(map(list, zip(*period_dates_row)))})
+
+        # Первые слагаемые CW..DE и DY..EB одним batchGet (свои столбцы внутри диапазона берутся из written_cols)
+        try:
+            left_block, right_block = worksheet.batch_get(['CW5:DE', 'DY5:EB'], value_render_option='UNFORMATTED_VALUE')
+            cached_cols.update(split_columns(left_block, 'CW', 9))
+            cached_cols.update(split_columns(right_block, 'DY', 4))
+        except Exception as e:
+            logger.warning(f"Не удалось прочитать столбцы для сумм: {e}")
 
-        # 7. ТОЛЬКО ПОСЛЕ ВСЕХ ЗАПИСЕЙ - выполняем суммирование новых столбцов
+        # Суммы DG–DK
+        for target_col, (left_col, right_col) in col_pairs.items():
+            left_vals = get_column(left_col)
+            right_vals = get_column(right_col)
+            summed = sum_columns(left_vals, right_vals)
+            payload.append({'range': f'{target_col}5', 'values': summed})
+            logger.info(f"Подготовлен столбец {target_col} = {left_col} + {right_col}")
+
+        # 7. Суммы EG–EJ
         sum_pairs = {
             'EG': ('DY', 'EC'),  # DY + EC
             'EH': ('DZ', 'ED'),  # DZ + ED
@@ -342,15 +400,20 @@ def write_to_sheet(worksheet, dates, datetime_postings, offer_map, orders):
             left_vals = get_column(left_col)
             right_vals = get_column(right_col)
             summed = sum_columns(left_vals, right_vals)
-            worksheet.update(values=summed, range_name=f'{target_col}5')
-            logger.info(f"Обновлён столбец {target_col} = {left_col} + {right_col}")
+            payload.append({'range': f'{target_col}5', 'values': summed})
+            logger.info(f"Подготовлен столбец {target_col} = {left_col} + {right_col}")
+
+        worksheet.batch_update(payload)
+        logger.info(f"Записано {len(payload)} диапазонов одним запросом")
 
-        # 8. Форматирование (после всех записей)
+        # 8. Форматирование (после всех записей) — все диапазоны одним batchUpdate вместо format() на каждый столбец
         try:
+            number_format = {"numberFormat": {"type": "NUMBER"}}
             end_col = chr(ord('T') + len(dates))
-            worksheet.format(f'BT3:{end_col}', {"numberFormat": {"type": "NUMBER"}})
+            format_ranges = [f'BT3:{end_col}']
             for col in list(period_columns.values()) + list(col_pairs.keys()) + list(cancel_periods.values()) + list(delivered_periods.values()) + list(sum_pairs.keys()):
-                worksheet.format(f'{col}5:{col}', {"numberFormat": {"type": "NUMBER"}})
+                format_ranges.append(f'{col}5:{col}')
+            worksheet.batch_format([{'range': rng, 'format': number_format} for rng in format_ranges])
         except Exception as format_error:
             logger.warning(f"Форматирование не применено: {format_error}")
 
@@ -367,23 +430,28 @@ def main():
 
         moscow_tz = tz('Europe/Moscow')
         now_moscow = datetime.now(moscow_tz)
-        since_date = (now_moscow - timedelta(days=170)).astimezone(timezone.utc).isoformat()
-        to_date = now_moscow.astimezone(timezone.utc).isoformat()
+        since_date = (now_moscow - timedelta(days=170)).astimezone(timezone.utc)
+        to_date = now_moscow.astimezone(timezone.utc)
 
-        orders = get_ozon_orders(client_id, api_key, since_date, to_date)
+        orders = get_ozon_orders(create_ozon_session(client_id, api_key), since_date, to_date)
         if not orders:
             logger.warning("Не получены заказы от API Ozon")
             return
+        enrich_orders(orders)
 
         logger.info(f"Получено {len(orders)} заказов")
+        clear_output_ranges(worksheet)
 
-        dates, datetime_postings = group_postings_by_datetime(orders, days=28)
-        offer_map = map_offer_id_to_dates(orders)
+        df = orders_frame(orders)
+        dates, date_totals = group_postings_by_datetime(df, days=28)
+        offer_map = map_offer_id_to_dates(df)
 
-        write_to_sheet(worksheet, dates, datetime_postings, offer_map, orders)
+        write_to_sheet(worksheet, dates, date_totals, offer_map, df)
 
     except Exception as e:
         logger.error(f"Критическая ошибка: {e}", exc_info=True)
+        # Ненулевой код, чтобы ALL_START засчитал запуск как неуспешный
+        sys.exit(1)
     finally:
         logger.info("Скрипт завершил работу")
 
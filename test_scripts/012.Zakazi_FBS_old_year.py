@@ -1,11 +1,15 @@
 # -*- coding: utf-8 -*-
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from pytz import timezone as tz
 from collections import defaultdict
 import logging
+import sys
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(message)s", datefmt="%Y-%m-%d %H:%M:%S")
 logger = logging.getLogger(__name__)
@@ -32,18 +36,43 @@ def setup_google_sheets(sheet_id, target_sheet_name):
     except gspread.exceptions.WorksheetNotFound:
         worksheet = spreadsheet.add_worksheet(title=target_sheet_name, rows="1000", cols="100")
         logger.info(f"Создан новый лист '{target_sheet_name}'")
+    return worksheet
 
+def clear_output_ranges(worksheet):
+    """Очистка столбцов скрипта; вызывается только после успешной выгрузки заказов"""
     # Очищаем только с 5-й строки, чтобы не затронуть EM4, EO4, EQ4
     worksheet.batch_clear(["EM5:EM", "EO5:EO", "EQ5:EQ", "ER5:ER"])
-    return worksheet
 
-def get_ozon_orders(client_id, api_key, since, to):
-    url = "https://api-seller.ozon.ru/v3/posting/fbs/list"
-    headers = {
+# Окна дат, которые выгружаются параллельно (по числу соединений в пуле сессии)
+FETCH_WORKERS = 4
+WINDOW_DAYS = 30
+
+def create_ozon_session(client_id, api_key):
+    """Сессия Ozon API: keep-alive между страницами; на 429/5xx urllib3 сам ждет (с учетом Retry-After) и повторяет"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_connections=2,
+        pool_maxsize=FETCH_WORKERS,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=1,
+            backoff_max=30,
+            # случайная добавка к паузе, чтобы повторы разных запросов не совпадали по времени
+            backoff_jitter=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+        ),
+    ))
+    session.headers.update({
         "Client-Id": client_id,
         "Api-Key": api_key,
         "Content-Type": "application/json"
-    }
+    })
+    return session
+
+def fetch_orders_window(session, since, to):
+    """Все отправления одного окна дат (постранично, по offset)"""
+    url = "https://api-seller.ozon.ru/v3/posting/fbs/list"
 
     all_orders = []
     offset = 0
@@ -59,7 +88,7 @@ def get_ozon_orders(client_id, api_key, since, to):
         }
 
         try:
-            response = requests.post(url, headers=headers, json=payload)
+            response = session.post(url, json=payload)
             response.raise_for_status()
             data = response.json()
             postings = data.get('result', {}).get('postings', [])
@@ -70,39 +99,88 @@ def get_ozon_orders(client_id, api_key, since, to):
             if not data['result'].get('has_next', False):
                 break
         except Exception as e:
+            # повторы уже исчерпаны сессией; выход из цикла молча обрезал бы выгрузку
             logger.error(f"Ошибка API Ozon: {e}")
-            break
+            raise
 
     return all_orders
 
-def get_last_year_month_delivered(orders, year, month):
-    moscow_tz = tz('Europe/Moscow')
-    delivered_map = defaultdict(int)
-
-    start_date = datetime(year, month, 1, tzinfo=moscow_tz)
-    if month == 12:
-        end_date = datetime(year + 1, 1, 1, tzinfo=moscow_tz)
-    else:
-        end_date = datetime(year, month + 1, 1, tzinfo=moscow_tz)
+def split_period(since, to, days=WINDOW_DAYS):
+    """Разбить [since, to] на окна по days дней, от новых к старым (как dir=DESC)"""
+    windows = []
+    end = to
+    while end > since:
+        start = max(since, end - timedelta(days=days))
+        windows.append((start, end))
+        end = start
+    return windows
+
+def get_ozon_orders(session, since, to):
+    """
+    Заказы FBS за период [since, to] (datetime в UTC).
+    Ozon не отдает общее число отправлений, поэтому параллелятся не страницы, а окна дат:
+    каждое окно листается по offset в своем потоке.
+    """
+    windows = split_period(since, to)
+    with ThreadPoolExecutor(max_workers=FETCH_WORKERS) as executor:
+        results = executor.map(
+            lambda window: fetch_orders_window(session, window[0].isoformat(), window[1].isoformat()),
+            windows
+        )
+        all_orders = []
+        seen = set()
+        for orders in results:
+            for order in orders:
+                # границы окон включаются в оба соседних окна
+                key = order.get('posting_number')
+                if key is not None:
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                all_orders.append(order)
+    return all_orders
 
+def enrich_orders(orders):
+    """Один разбор in_process_at на заказ: '_mtime' — время по Москве (None, если дату разобрать не удалось)"""
+    moscow_tz = tz('Europe/Moscow')
     for order in orders:
-        if order.get("status") != "delivered":
+        try:
+            # fromisoformat (Python 3.11+) сам понимает суффикс 'Z'
+            utc_time = datetime.fromisoformat(order["in_process_at"]).replace(tzinfo=timezone.utc)
+            order['_mtime'] = utc_time.astimezone(moscow_tz)
+        except Exception as e:
+            logger.warning(f"Ошибка обработки заказа: {e}")
+            order['_mtime'] = None
+    return orders
+
+def get_last_year_month_delivered_all(delivered_orders, year, months):
+    """
+    Доставлено по offer_id за каждый месяц из months года year: {месяц: (delivered_map, период 'дд.мм.гг дд.мм.гг')}.
+    delivered_orders — уже отобранные доставленные заказы с разобранной датой (см. main); один проход на все месяцы.
+    """
+    results = {month: defaultdict(int) for month in months}
+
+    for order in delivered_orders:
+        moscow_time = order['_mtime']
+        if moscow_time.year != year or moscow_time.month not in results:
             continue
+        delivered_map = results[moscow_time.month]
         try:
-            utc_time = datetime.fromisoformat(order["in_process_at"].replace('Z', '+00:00')).replace(tzinfo=timezone.utc)
-            moscow_time = utc_time.astimezone(moscow_tz)
-            if start_date <= moscow_time < end_date:
-                for product in order.get("products", []):
-                    offer_id = product.get("offer_id")
-                    quantity = int(product.get("quantity", 0))
-                    if offer_id:
-                        delivered_map[offer_id] += quantity
+            for product in order.get("products", []):
+                offer_id = product.get("offer_id")
+                quantity = int(product.get("quantity", 0))
+                if offer_id:
+                    delivered_map[offer_id] += quantity
         except Exception as e:
             logger.warning(f"Ошибка обработки заказа: {e}")
             continue
 
-    period = f"{start_date.strftime('%d.%m.%y')} {end_date.strftime('%d.%m.%y')}"
-    return delivered_map, period
+    periods = {}
+    for month, delivered_map in results.items():
+        start_date = datetime(year, month, 1)
+        end_date = datetime(year + 1, 1, 1) if month == 12 else datetime(year, month + 1, 1)
+        periods[month] = (delivered_map, f"{start_date.strftime('%d.%m.%y')} {end_date.strftime('%d.%m.%y')}")
+    return periods
 
 def main():
     try:
@@ -119,45 +197,45 @@ def main():
 
         start_range = datetime(last_year, min(months_needed), 1, tzinfo=tz('Europe/Moscow'))
         end_range = datetime(last_year + (1 if max(months_needed) == 12 else 0), (max(months_needed) % 12) + 1, 1, tzinfo=tz('Europe/Moscow'))
-        since_date = start_range.astimezone(timezone.utc).isoformat()
-        to_date = end_range.astimezone(timezone.utc).isoformat()
+        since_date = start_range.astimezone(timezone.utc)
+        to_date = end_range.astimezone(timezone.utc)
 
-        orders = get_ozon_orders(client_id, api_key, since_date, to_date)
+        orders = get_ozon_orders(create_ozon_session(client_id, api_key), since_date, to_date)
         if not orders:
             logger.warning("Нет заказов от API")
             return
+        enrich_orders(orders)
+        clear_output_ranges(worksheet)
+        # Месяцы считаются только по доставленным: отбор по статусу и дате один раз, а не в каждом месяце
+        delivered_orders = [o for o in orders if o.get("status") == "delivered" and o['_mtime'] is not None]
 
         offer_column = worksheet.col_values(4)[4:]  # Столбец D, начиная с 5 строки
         months_cols = [('EM', months_needed[0]), ('EO', months_needed[1]), ('EQ', months_needed[2])]
 
+        delivered_by_month = get_last_year_month_delivered_all(delivered_orders, last_year, months_needed)
+
+        # Заголовки и данные трех месяцев — одним batch_update (RAW по умолчанию) вместо двух update на столбец
+        payload = []
         for col_letter, month in months_cols:
-            delivered_data, period = get_last_year_month_delivered(orders, last_year, month)
-            worksheet.update(range_name=f"{col_letter}3", values=[[period]])
+            delivered_data, period = delivered_by_month[month]
+            payload.append({'range': f"{col_letter}3", 'values': [[period]]})
             values = [[delivered_data.get(offer_id, 0)] for offer_id in offer_column]
-            worksheet.update(range_name=f"{col_letter}5:{col_letter}", values=values)
-            logger.info(f"Обновлён столбец {col_letter} за период {period}")
-
-        # Сумма EL + EM + EN + EO + EP + EQ -> ER
-        el = worksheet.col_values(142)[4:]  # EL
-        em = worksheet.col_values(143)[4:]  # EM
-        en = worksheet.col_values(144)[4:]  # EN
-        eo = worksheet.col_values(145)[4:]  # EO
-        ep = worksheet.col_values(146)[4:]  # EP
-        eq = worksheet.col_values(147)[4:]  # EQ
-
-        sums = []
-        for values in zip(el, em, en, eo, ep, eq):
-            try:
-                total = sum(int(v) if v.strip().isdigit() else 0 for v in values)
-                sums.append([total])
-            except Exception:
-                sums.append([0])
-
-        worksheet.update(range_name="ER5:ER", values=sums)
+            payload.append({'range': f"{col_letter}5:{col_letter}", 'values': values})
+            logger.info(f"Подготовлен столбец {col_letter} за период {period}")
+        worksheet.batch_update(payload)
+        logger.info("Обновлены столбцы EM, EO, EQ")
+
+        # Сумма EL + EM + EN + EO + EP + EQ -> ER формулой: считает сама таблица, без чтения EL:EQ.
+        # SUM, как и прежний подсчет, пропускает пустые ячейки и текст; строки без SKU остаются пустыми
+        sums = [[f"=SUM(EL{row}:EQ{row})" if offer_id else ''] for row, offer_id in enumerate(offer_column, start=5)]
+        if sums:
+            worksheet.update(range_name=f"ER5:ER{len(sums) + 4}", values=sums, value_input_option='USER_ENTERED')
         logger.info("Обновлён столбец ER (сумма EL:EQ)")
 
     except Exception as e:
         logger.error(f"Ошибка выполнения: {e}", exc_info=True)
+        # Ненулевой код, чтобы ALL_START засчитал запуск как неуспешный
+        sys.exit(1)
     finally:
         logger.info("Скрипт завершён")
 
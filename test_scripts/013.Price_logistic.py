@@ -1,7 +1,10 @@
 import requests
-import json
+import orjson
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import gspread
-import math
+import numpy as np
 from oauth2client.service_account import ServiceAccountCredentials
 from datetime import datetime
 
@@ -9,7 +12,7 @@ def read_api_credentials(file_path):
     """Read credentials from API file"""
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
-            lines = [line.strip() for line in file.readlines() if line.strip()]
+            lines = [line.strip() for line in file.read().splitlines() if line.strip()]
             if len(lines) >= 4:
                 return lines[0], lines[1], lines[2], lines[3]
             else:
@@ -34,113 +37,162 @@ def safe_float(value):
     except (ValueError, TypeError):
         return 0.0
 
-def read_product_ids_from_sheet(spreadsheet_id, worksheet_name):
+def open_worksheet(spreadsheet_id, worksheet_name):
+    """Authorize once and open the worksheet; reading and writing share this client and its session"""
+    client = authorize_google_sheets("credentials.json")
+    return client.open_by_key(spreadsheet_id).worksheet(worksheet_name)
+
+def read_sheet_inputs(worksheet):
+    """product_ids from A5:A and the ET2 value in one batchGet: (product_ids, dq1_value)"""
     try:
-        client = authorize_google_sheets("credentials.json")
-        sheet = client.open_by_key(spreadsheet_id)
-        worksheet = sheet.worksheet(worksheet_name)
-        return [int(pid) for pid in worksheet.col_values(1)[4:] if pid and pid.isdigit()]
+        column_a, et2 = worksheet.batch_get(['A5:A', 'ET2'], major_dimension='COLUMNS')
+        product_ids = [int(pid) for pid in (column_a[0] if column_a else []) if pid and pid.isdigit()]
+        dq1_value = safe_float(et2[0][0]) if et2 and et2[0] else 0
+        return product_ids, dq1_value
     except Exception as e:
         raise Exception(f"Error reading product_ids: {str(e)}")
 
-def get_ozon_prices(client_id, api_key, product_ids, limit=1000):
-    url = "https://api-seller.ozon.ru/v5/product/info/prices"
-    headers = {
+# Chunks of product_ids requested in parallel
+PRICE_WORKERS = 8
+
+def create_ozon_session(client_id, api_key):
+    """One pooled session for all chunks; urllib3 retries 429/5xx honouring Retry-After"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_maxsize=PRICE_WORKERS,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=1,
+            backoff_max=30,
+            backoff_jitter=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+        ),
+    ))
+    session.headers.update({
         "Client-Id": str(client_id),
         "Api-Key": str(api_key),
         "Content-Type": "application/json"
-    }
+    })
+    return session
+
+def fetch_prices_chunk(session, chunk, limit):
+    """Prices for one chunk of product_ids: {product_id: item} (empty on error)"""
+    url = "https://api-seller.ozon.ru/v5/product/info/prices"
+    data = {"filter": {"product_id": chunk}, "limit": limit}
+    prices = {}
+
+    try:
+        response = session.post(url, data=orjson.dumps(data), timeout=30)
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+
+        if 'items' in result:
+            for item in result['items']:
+                if item is None:
+                    print(f"Warning: Received None for product in chunk {chunk}")
+                    continue
+                if 'product_id' in item:
+                    prices[item['product_id']] = item
+                else:
+                    print(f"Warning: Item without product_id in chunk {chunk}")
+        else:
+            print(f"Unexpected API response for chunk {chunk}")
+    except Exception as e:
+        print(f"Error for products {chunk}: {str(e)}")
+
+    return prices
+
+def get_ozon_prices(client_id, api_key, product_ids, limit=1000):
+    chunks = [product_ids[i:i + limit] for i in range(0, len(product_ids), limit)]
 
     all_prices = {}
-    for i in range(0, len(product_ids), limit):
-        chunk = product_ids[i:i + limit]
-        data = {"filter": {"product_id": chunk}, "limit": limit}
-
-        try:
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-
-            if 'items' in result:
-                for item in result['items']:
-                    if item is None:
-                        print(f"Warning: Received None for product in chunk {chunk}")
-                        continue
-                    if 'product_id' in item:
-                        all_prices[item['product_id']] = item
-                    else:
-                        print(f"Warning: Item without product_id in chunk {chunk}")
-            else:
-                print(f"Unexpected API response for chunk {chunk}")
-        except Exception as e:
-            print(f"Error for products {chunk}: {str(e)}")
+    with create_ozon_session(client_id, api_key) as session:
+        with ThreadPoolExecutor(max_workers=PRICE_WORKERS) as executor:
+            for prices in executor.map(lambda chunk: fetch_prices_chunk(session, chunk, limit), chunks):
+                all_prices.update(prices)
 
     return all_prices
 
+# Promotions not listed in the actions column (set: looked up for every action of every product)
+EXCLUDED_ACTIONS = frozenset({
+    "Рассрочка 0-0-6 на всё РФ товары",
+    "WOW-БЭК_Кэшбэк на покупку Ozon Fashion списание 2.0",
+    "ВАУ баллы 50% 9 волна 3-я волна (основная)",
+    "Ozon Fashion + Jardin 500 вау баллов  списание",
+    "Ozon Fashion + Jardin 1000 списание",
+    "[Ozon Fashion + Jardin 10 000 списание",
+    "Ozon Fashion + Jardin списание 1 млн",
+    "Ozon Fashion + Jardin списание 1 млн вторая",
+    "Ozon Fashion + Jardin_Запасная акция 500 вау баллов списание",
+    "Ozon Fashion + Jardin_Запасная акция 1000 вау баллов списание",
+    "Ozon Fashion + Jardin_Запасная акция 10 000 вау баллов списание",
+    "Ozon Fashion + Jardin 10 000 списание"
+})
+
+# Row for a product without API data: ET..FQ, same width as a data row (including net_price).
+# Shared by all such rows; rows are only serialized, never modified
+EMPTY_ROW = [''] * 24
+
+# Price index color from the API -> text in the sheet (built once, not per call)
+COLOR_INDEX_MAPPING = {
+    "WITHOUT_INDEX": "НЕТ",
+    "GREEN": "ХОРОШИЙ",
+    "YELLOW": "СРЕДНИЙ",
+    "RED": "ПЛОХОЙ"
+}
+
 def prepare_data_for_sheet(data, product_ids, dq1_value):
-    color_index_mapping = {
-        "WITHOUT_INDEX": "НЕТ",
-        "GREEN": "ХОРОШИЙ",
-        "YELLOW": "СРЕДНИЙ",
-        "RED": "ПЛОХОЙ"
-    }
-    
-    EXCLUDED_ACTIONS = [
-        "Рассрочка 0-0-6 на всё РФ товары",
-        "WOW-БЭК_Кэшбэк на покупку Ozon Fashion списание 2.0",
-        "ВАУ баллы 50% 9 волна 3-я волна (основная)",
-        "Ozon Fashion + Jardin 500 вау баллов  списание",
-        "Ozon Fashion + Jardin 1000 списание",
-        "[Ozon Fashion + Jardin 10 000 списание",
-        "Ozon Fashion + Jardin списание 1 млн",
-        "Ozon Fashion + Jardin списание 1 млн вторая",
-        "Ozon Fashion + Jardin_Запасная акция 500 вау баллов списание",
-        "Ozon Fashion + Jardin_Запасная акция 1000 вау баллов списание",
-        "Ozon Fashion + Jardin_Запасная акция 10 000 вау баллов списание",
-        "Ozon Fashion + Jardin 10 000 списание"
+    def nested(item, key):
+        return item.get(key) or {}
+
+    # Products with API data, in sheet order; the numeric columns are computed for all of them at once
+    items = [item for item in map(data.get, product_ids) if item is not None]
+    prices = [nested(item, 'price') for item in items]
+    commissions = [nested(item, 'commissions') for item in items]
+
+    def column(source, key):
+        return np.fromiter((safe_float(entry.get(key)) for entry in source), dtype=np.float64, count=len(items))
+
+    marketing_seller_price = column(prices, 'marketing_seller_price')
+    sales_percent_fbo = column(commissions, 'sales_percent_fbo')
+    sales_percent_fbs = column(commissions, 'sales_percent_fbs')
+
+    acquiring = np.ceil(column(items, 'acquiring'))
+    fbo_transport = np.ceil(column(commissions, 'fbo_direct_flow_trans_max_amount'))
+    fbs_transport = np.ceil(column(commissions, 'fbs_direct_flow_trans_max_amount'))
+    fbo_delivery = np.ceil(column(commissions, 'fbo_deliv_to_customer_amount'))
+    fbs_delivery = np.ceil(column(commissions, 'fbs_deliv_to_customer_amount'))
+
+    # Calculations (a zero price or percent gives ceil(0) = 0, same as the former explicit check)
+    dr_value = np.ceil((marketing_seller_price * sales_percent_fbo) / 100)
+    ds_value = np.ceil((marketing_seller_price * sales_percent_fbs) / 100)
+    dt_value = np.ceil(acquiring + dr_value + fbo_transport + fbo_delivery)
+    du_value = np.ceil(acquiring + fbs_transport + fbs_delivery + ds_value + dq1_value)
+
+    # Rounded columns back to Python ints for the sheet
+    numeric = [
+        values.astype(np.int64).tolist()
+        for values in (acquiring, dr_value, fbo_transport, fbo_delivery,
+                       ds_value, fbs_transport, fbs_delivery, dt_value, du_value)
     ]
+    sales_percent_fbo = sales_percent_fbo.tolist()
+    sales_percent_fbs = sales_percent_fbs.tolist()
+    marketing_seller_price = marketing_seller_price.tolist()
 
     rows = []
+    k = 0
     for product_id in product_ids:
-        if product_id in data and data[product_id] is not None:
-            item = data[product_id]
-            
-            # Initialize all nested dictionaries safely
-            price_data = item.get('price', {}) if item.get('price') is not None else {}
-            commissions = item.get('commissions', {}) if item.get('commissions') is not None else {}
-            price_indexes = item.get('price_indexes', {}) if item.get('price_indexes') is not None else {}
-            marketing_actions = item.get('marketing_actions', {}) if item.get('marketing_actions') is not None else {}
-            marketing_actions = marketing_actions.get('actions', []) if marketing_actions.get('actions') is not None else []
+        if data.get(product_id) is not None:
+            item = items[k]
+            price_data = prices[k]
+            item_commissions = commissions[k]
+            price_indexes = nested(item, 'price_indexes')
+            marketing_actions = nested(item, 'marketing_actions').get('actions') or []
 
             # Main data with safe access
             auto_action = "🔥" if price_data.get('auto_action_enabled', False) else "🔕"
-            old_price = safe_float(price_data.get('old_price'))
-            min_price = safe_float(price_data.get('min_price'))
-            price = safe_float(price_data.get('price'))
-            marketing_seller_price = safe_float(price_data.get('marketing_seller_price'))
-            marketing_price = safe_float(price_data.get('marketing_price'))
-            net_price = safe_float(price_data.get('net_price'))  # Получаем net_price из API
-            
-            color_index = color_index_mapping.get(
-                price_indexes.get('color_index', 'WITHOUT_INDEX'),
-                'WITHOUT_INDEX'
-            )
-
-            # Commissions and calculations with safe access
-            acquiring = math.ceil(safe_float(item.get('acquiring')))
-            sales_percent_fbo = safe_float(commissions.get('sales_percent_fbo'))
-            sales_percent_fbs = safe_float(commissions.get('sales_percent_fbs'))
-
-            fbo_transport = math.ceil(safe_float(commissions.get('fbo_direct_flow_trans_max_amount')))
-            fbs_transport = math.ceil(safe_float(commissions.get('fbs_direct_flow_trans_max_amount')))
-            fbo_delivery = math.ceil(safe_float(commissions.get('fbo_deliv_to_customer_amount')))
-            fbs_delivery = math.ceil(safe_float(commissions.get('fbs_deliv_to_customer_amount')))
-
-            # Calculations
-            dr_value = math.ceil((marketing_seller_price * sales_percent_fbo) / 100) if marketing_seller_price and sales_percent_fbo else 0
-            ds_value = math.ceil((marketing_seller_price * sales_percent_fbs) / 100) if marketing_seller_price and sales_percent_fbs else 0
-            dt_value = math.ceil(acquiring + dr_value + fbo_transport + fbo_delivery)
-            du_value = math.ceil(acquiring + fbs_transport + fbs_delivery + ds_value + dq1_value)
+            color_index = COLOR_INDEX_MAPPING.get(price_indexes.get('color_index', 'WITHOUT_INDEX'), 'WITHOUT_INDEX')
 
             # Process marketing actions
             action_titles = []
@@ -153,42 +205,39 @@ def prepare_data_for_sheet(data, product_ids, dq1_value):
                         actions_count += 1
             action_title = " ".join(action_titles) if action_titles else ""
 
+            acq, dr, fbo_tr, fbo_del, ds, fbs_tr, fbs_del, dt, du = (values[k] for values in numeric)
             row = [
-                acquiring, sales_percent_fbo, dr_value, fbo_transport, fbo_delivery,
-                safe_float(commissions.get('fbo_return_flow_amount')),
-                sales_percent_fbs, ds_value, fbs_transport, fbs_delivery,
-                safe_float(commissions.get('fbs_return_flow_amount')),
-                dt_value, du_value,
-                "", auto_action, old_price, min_price, price,
-                marketing_seller_price, marketing_price, color_index,
+                acq, sales_percent_fbo[k], dr, fbo_tr, fbo_del,
+                safe_float(item_commissions.get('fbo_return_flow_amount')),
+                sales_percent_fbs[k], ds, fbs_tr, fbs_del,
+                safe_float(item_commissions.get('fbs_return_flow_amount')),
+                dt, du,
+                "", auto_action,
+                safe_float(price_data.get('old_price')),
+                safe_float(price_data.get('min_price')),
+                safe_float(price_data.get('price')),
+                marketing_seller_price[k],
+                safe_float(price_data.get('marketing_price')),
+                color_index,
                 action_title,
                 actions_count,
-                net_price  # Добавляем net_price из API
+                safe_float(price_data.get('net_price'))  # Получаем net_price из API
             ]
+            k += 1
         else:
-            row = [''] * 27  # Увеличиваем на 1 для нового столбца net_price
+            row = EMPTY_ROW
 
         rows.append(row)
 
     return rows
 
-def write_data_to_sheet(spreadsheet_id, worksheet_name, data, product_ids):
+def write_data_to_sheet(worksheet, data, product_ids, dq1_value):
     try:
-        client = authorize_google_sheets("credentials.json")
-        sheet = client.open_by_key(spreadsheet_id)
-        worksheet = sheet.worksheet(worksheet_name)
-
-        # Get value from ET2 safely
-        dq1_cell = worksheet.acell('ET2')
-        dq1_value = safe_float(dq1_cell.value) if dq1_cell else 0
-
-        # Clear the range ET5:FQ (расширяем до FQ для нового столбца net_price)
-        worksheet.batch_clear([f'ET5:FQ{4 + len(product_ids)}'])
-
         # Prepare data
         rows = prepare_data_for_sheet(data, product_ids, dq1_value)
 
-        # Write all data at once
+        # Write all data at once; rows are full ET:FQ width ('' for missing products),
+        # so the update overwrites the whole range and a separate clear is not needed
         if rows:
             worksheet.update(
                 range_name=f'ET5:FQ{4 + len(rows)}',  # Обновляем до FQ
@@ -205,7 +254,8 @@ def main():
         print("Starting script...")
         client_id, api_key, spreadsheet_id, worksheet_name = read_api_credentials("(1)API.txt")
 
-        product_ids = read_product_ids_from_sheet(spreadsheet_id, worksheet_name)
+        worksheet = open_worksheet(spreadsheet_id, worksheet_name)
+        product_ids, dq1_value = read_sheet_inputs(worksheet)
         if not product_ids:
             raise Exception("No product_ids to process")
 
@@ -213,7 +263,7 @@ def main():
         if not data:
             raise Exception("No data received from API")
 
-        write_data_to_sheet(spreadsheet_id, worksheet_name, data, product_ids)
+        write_data_to_sheet(worksheet, data, product_ids, dq1_value)
         print("Script completed successfully")
     except Exception as e:
         print(f"Error: {str(e)}")
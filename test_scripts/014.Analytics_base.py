@@ -1,14 +1,24 @@
 # -*- coding: utf-8 -*-
-import requests
+import asyncio
+import functools
+import os
+from pathlib import Path
+import aiohttp
+import orjson
 from datetime import datetime, timezone, timedelta
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
 
 
+@functools.lru_cache(maxsize=8)
+def _load_config_lines(filename: str, mtime: float) -> tuple:
+    """Parsed config lines, cached per (path, mtime): re-read only when the file changes."""
+    return tuple(line.strip() for line in Path(filename).read_text(encoding='utf-8').splitlines())
+
+
 def read_api_config(filename: str) -> dict:
     """Read API configuration from file."""
-    with open(filename, 'r', encoding='utf-8') as file:
-        lines = [line.strip() for line in file.readlines()]
+    lines = _load_config_lines(filename, os.path.getmtime(filename))
     if len(lines) < 4:
         raise ValueError("File (1)API.txt must contain 4 lines: client_id, api-key, Google spreadsheet ID, sheet name")
     return {
@@ -19,20 +29,53 @@ def read_api_config(filename: str) -> dict:
     }
 
 
-def fetch_product_queries_data(url: str, headers: dict, payload: dict) -> list:
+# SKU batches are requested concurrently, at most this many at a time
+MAX_CONCURRENT_REQUESTS = 4
+
+
+async def fetch_product_queries_data(session: aiohttp.ClientSession, url: str, payload: dict) -> list:
     """Get product queries data (one batch up to 1000 SKU)."""
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=30)
-        if resp.status_code != 200:
-            print(f"Response status: {resp.status_code} - {resp.text[:200]}")
-            return []
-        data = resp.json()
-        return data.get('items', []) or []
+        async with session.post(url, data=orjson.dumps(payload), timeout=aiohttp.ClientTimeout(total=30)) as resp:
+            if resp.status != 200:
+                text = await resp.text()
+                print(f"Response status: {resp.status} - {text[:200]}")
+                return []
+            data = orjson.loads(await resp.read())
+            return data.get('items', []) or []
     except Exception as e:
         print(f"Request error: {e}")
         return []
 
 
+async def fetch_all_product_queries(url: str, headers: dict, payloads: list) -> list:
+    """Fetch all batches concurrently; results keep the order of payloads."""
+    sem = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+
+    async def fetch(session, payload):
+        async with sem:
+            return await fetch_product_queries_data(session, url, payload)
+
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(headers=headers, connector=connector) as session:
+        return await asyncio.gather(*(fetch(session, payload) for payload in payloads))
+
+
+def write_header(sheet, date_str: str) -> None:
+    """Write the report date into merged cell FX3:GB3."""
+    try:
+        # merge cells; if already merged - continue silently
+        try:
+            sheet.merge_cells('FX3:GB3')
+        except Exception:
+            pass
+        # correct write without DeprecationWarning
+        sheet.update(values=[[f"Данные от {date_str}"]], range_name='FX3', value_input_option='RAW')
+        print("Date written to FX3:GB3")
+    except Exception as e:
+        print(f"Error writing date to FX3:GB3: {e}")
+
+
 def chunks(lst, n):
     """Split list into chunks of n elements."""
     for i in range(0, len(lst), n):
@@ -70,9 +113,16 @@ def main():
 
     # SKU
     try:
-        sku_col = sheet.col_values(2)[4:]  # B5:B
-        skus = [sku.strip() for sku in sku_col if sku.strip()]
-        sku_to_row = {sku: idx + 5 for idx, sku in enumerate(sku_col) if sku.strip()}
+        column_b = sheet.get('B5:B', major_dimension='COLUMNS', value_render_option='UNFORMATTED_VALUE')
+        sku_col = column_b[0] if column_b else []  # B5:B
+        # One pass: SKU list for the API and SKU -> sheet row for the write-back
+        skus = []
+        sku_to_row = {}
+        for row, value in enumerate(sku_col, start=5):
+            sku = str(value).strip()
+            if sku:
+                skus.append(sku)
+                sku_to_row[sku] = row
         print(f"Got {len(sku_to_row)} SKU from Google Sheet")
         if not skus:
             print("SKU list is empty.")
@@ -96,22 +146,11 @@ def main():
     print(f"Data for {date_str}")
 
     # === Header in merged cell FX3:GB3 ===
-    try:
-        # merge cells; if already merged - continue silently
-        try:
-            sheet.merge_cells('FX3:GB3')
-        except Exception:
-            pass
-        # correct write without DeprecationWarning
-        sheet.update(values=[[f"Данные от {date_str}"]], range_name='FX3')
-        print("Date written to FX3:GB3")
-    except Exception as e:
-        print(f"Error writing date to FX3:GB3: {e}")
+    write_header(sheet, date_str)
 
     # Collect data in batches
-    all_items = []
-    for i, batch in enumerate(chunks(skus, 1000), start=1):
-        payload = {
+    payloads = [
+        {
             "date_from": date_from,
             "date_to": date_to,
             "skus": batch,
@@ -119,7 +158,10 @@ def main():
             "sort_by": "BY_SEARCHES",
             "sort_dir": "DESCENDING",
         }
-        items = fetch_product_queries_data(url, headers, payload)
+        for batch in chunks(skus, 1000)
+    ]
+    all_items = []
+    for i, items in enumerate(asyncio.run(fetch_all_product_queries(url, headers, payloads)), start=1):
         print(f"Batch {i}: {len(items)} records")
         all_items.extend(items)
 
@@ -128,8 +170,8 @@ def main():
     # Dictionary SKU -> data
     sku_data = {str(it.get('sku', '')).strip(): it for it in all_items if it.get('sku')}
 
-    updates = []
     missing_skus = []
+    values_by_row = {}
 
     # >>> Write metrics to FX:GB
     # FX: Unique searches, FY: Position, FZ: Unique views, GA: Conversion, GB: GMV
@@ -146,7 +188,23 @@ def main():
         else:
             missing_skus.append(sku)
             values = [""] * 5
-        updates.append({'range': f"FX{row}:GB{row}", 'values': [values]})
+        values_by_row[row] = values
+
+    # Consecutive rows are merged into one range each: usually a single FX5:GBn block,
+    # rows without SKU stay untouched as before
+    updates = []
+    block_start = prev_row = None
+    block = []
+    for row in sorted(values_by_row):
+        if prev_row is not None and row != prev_row + 1:
+            updates.append({'range': f"FX{block_start}:GB{prev_row}", 'values': block})
+            block = []
+        if not block:
+            block_start = row
+        block.append(values_by_row[row])
+        prev_row = row
+    if block:
+        updates.append({'range': f"FX{block_start}:GB{prev_row}", 'values': block})
 
     if missing_skus:
         print(f"Data not found for {len(missing_skus)} SKU")
@@ -154,8 +212,8 @@ def main():
     # Update data
     if updates:
         try:
-            sheet.batch_update(updates)
-            print(f"Updated {len(updates)} rows of data (columns FX:GB)")
+            sheet.batch_update(updates, value_input_option='RAW')
+            print(f"Updated {len(values_by_row)} rows of data in {len(updates)} range(s) (columns FX:GB)")
         except Exception as e:
             print(f"Error updating data: {e}")
 
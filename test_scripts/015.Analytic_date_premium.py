@@ -1,11 +1,14 @@
 # -*- coding: utf-8 -*-
 
 import requests
-import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 from datetime import datetime
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-import time
 
 # ===== утилиты =====
 def col_index_to_letter(col_idx: int) -> str:
@@ -15,10 +18,27 @@ def col_index_to_letter(col_idx: int) -> str:
         result = chr(65 + rem) + result
     return result
 
+def col_letter_to_index(col: str) -> int:
+    result = 0
+    for ch in col:
+        result = result * 26 + (ord(ch) - 64)
+    return result
+
+def contiguous_runs(columns):
+    """Столбцы (в порядке записи) → списки подряд идущих столбцов, например [O, P, Q], [GH, ..., HC]"""
+    runs = []
+    for col in columns:
+        if runs and col_letter_to_index(col) == col_letter_to_index(runs[-1][-1]) + 1:
+            runs[-1].append(col)
+        else:
+            runs.append([col])
+    return runs
+
 # ===== конфиг =====
 def read_api_config(filename):
     with open(filename, 'r', encoding='utf-8') as file:
-        lines = [line.strip() for line in file.readlines()]
+        # пустые строки (в т.ч. в конце файла или из-за CRLF) пропускаются, как в остальных скриптах
+        lines = [line.strip() for line in file.read().splitlines() if line.strip()]
         if len(lines) < 4:
             raise ValueError("Файл API.txt должен содержать 4 строки: client_id, api-key, spreadsheet_id, sheet_name")
         return {
@@ -29,27 +49,62 @@ def read_api_config(filename):
         }
 
 # ===== запрос данных с пагинацией =====
+# Сколько страниц запрашивается наперед: число записей заранее неизвестно,
+# поэтому следующие offset-ы идут параллельно, а лишние после короткой страницы отбрасываются
+PREFETCH_PAGES = 3
+
+def create_ozon_session(headers):
+    """Общая сессия для всех страниц: пул соединений; 429/5xx повторяет urllib3 (с учетом Retry-After)"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(
+        pool_maxsize=PREFETCH_PAGES,
+        max_retries=Retry(
+            total=5,
+            backoff_factor=1,
+            backoff_max=30,
+            backoff_jitter=1,
+            status_forcelist=[429, 500, 502, 503, 504],
+            allowed_methods=["POST"],
+        ),
+    ))
+    session.headers.update(headers)
+    return session
+
+def fetch_page(session, url, payload, offset, limit):
+    response = session.post(url, data=orjson.dumps({**payload, 'offset': offset, 'limit': limit}), timeout=30)
+    response.raise_for_status()
+    return orjson.loads(response.content).get('result', {}).get('data', [])
+
 def fetch_data_with_pagination(url, headers, payload):
     all_data = []
-    offset = 0
     limit = 1000
-    while True:
-        payload['offset'] = offset
-        payload['limit'] = limit
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
-            data = response.json()
-        except Exception as e:
-            print(f"Ошибка при запросе: {e}")
-            break
-
-        results = data.get('result', {}).get('data', [])
-        all_data.extend(results)
-        if len(results) < limit:
-            break
-        offset += limit
-        time.sleep(1)
+    next_offset = 0
+    pages = deque()
+
+    with create_ozon_session(headers) as session, ThreadPoolExecutor(max_workers=PREFETCH_PAGES) as executor:
+        def submit_next():
+            nonlocal next_offset
+            pages.append(executor.submit(fetch_page, session, url, payload, next_offset, limit))
+            next_offset += limit
+
+        for _ in range(PREFETCH_PAGES):
+            submit_next()
+
+        # Страницы разбираются строго по порядку offset
+        while pages:
+            try:
+                results = pages.popleft().result()
+            except Exception as e:
+                print(f"Ошибка при запросе: {e}")
+                break
+
+            all_data.extend(results)
+            if len(results) < limit:
+                break
+            submit_next()
+
+        for page in pages:
+            page.cancel()
     return all_data
 
 def main():
@@ -75,7 +130,8 @@ def main():
 
     # --- SKU из колонки B5:B ---
     try:
-        sku_list = sheet.col_values(2)[4:]  # B5:B
+        column_b = sheet.get('B5:B', major_dimension='COLUMNS')  # сразу B5:B, без шапки
+        sku_list = column_b[0] if column_b else []
         sku_dict = {sku: idx+5 for idx, sku in enumerate(sku_list) if sku}
         print(f"Получено {len(sku_dict)} SKU")
     except Exception as e:
@@ -149,47 +205,48 @@ def main():
     }
 
     metric_idx_map = {m:i for i,m in enumerate(metrics_unique)}
+    # Для каждого столбца один раз: индекс метрики в ответе API и нужно ли округлять
+    metric_indices = [
+        (metric_idx_map.get(metric), metric == "position_category")
+        for metric in column_metric_map.values()
+    ]
 
-    updates = []
     missing_skus = []
+    row_values_by_row = {}
 
     for sku, row in sku_dict.items():
         if sku in sku_metrics:
             base = sku_metrics[sku]
             row_values = []
-            for col, metric in column_metric_map.items():
-                idx = metric_idx_map.get(metric)
+            for idx, rounded in metric_indices:
                 val = base[idx] if idx is not None else ""
-                if metric == "position_category" and val is not None:
+                if rounded and val is not None:
                     val = round(val)
                 row_values.append(val)
-            # batch_update требует: range + values как список списков
-            updates.append({
-                "range": f"{column_metric_map.keys().__iter__().__next__()}{row}",  # placeholder, потом заменим по каждой колонке
-                "values": [row_values]
-            })
         else:
             missing_skus.append(sku)
             row_values = [""]*len(column_metric_map)
-            updates.append({
-                "range": f"{column_metric_map.keys().__iter__().__next__()}{row}",
-                "values": [row_values]
-            })
+        row_values_by_row[row] = row_values
 
-    # --- Для правильного распределения: нужно делать отдельный update для каждого столбца ---
+    # --- Один прямоугольный диапазон на каждую группу подряд идущих столбцов (O:Q, GH:HC) ---
+    # Строки без SKU — None (null): batch_update их пропускает, ячейки остаются как есть
     batch_updates = []
-    for update in updates:
-        row = int(update['range'][1:])
-        for i, col in enumerate(column_metric_map.keys()):
+    if row_values_by_row:
+        last_row = max(row_values_by_row)
+        rows = [row_values_by_row.get(row) for row in range(5, last_row + 1)]
+        start = 0
+        for run in contiguous_runs(list(column_metric_map)):
+            stop = start + len(run)
             batch_updates.append({
-                "range": f"{col}{row}",
-                "values": [[update['values'][0][i]]]
+                "range": f"{run[0]}5:{run[-1]}{last_row}",
+                "values": [values[start:stop] if values is not None else [None]*len(run) for values in rows]
             })
+            start = stop
 
     if batch_updates:
         try:
             sheet.batch_update(batch_updates)
-            print(f"Успешно обновлено {len(batch_updates)} ячеек")
+            print(f"Успешно обновлено {len(row_values_by_row)} строк, диапазонов: {len(batch_updates)}")
         except Exception as e:
             print(f"Ошибка при обновлении данных: {e}")
 
@@ -1,29 +1,87 @@
 import os
+import sys
 import time
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
-scripts = [
-    "(1)002.Tovar_info.py",
-    "(1)003.Content_rating.py",
-    "(1)006.Stock_FBO_FBS.py",
-    "(1)007.Edet_na_FBO.py",
-    "(1)013.Price_logistic.py",
-]
+# Скрипт -> скрипты, которые должны завершиться до его запуска
+# (он читает столбцы, которые они пишут). Остальные независимы и идут параллельно.
+scripts = {
+    "(1)002.Tovar_info.py": [],
+    "(1)003.Content_rating.py": ["(1)002.Tovar_info.py"],  # SKU из B
+    "(1)006.Stock_FBO_FBS.py": [],
+    "(1)007.Edet_na_FBO.py": ["(1)002.Tovar_info.py"],
+    "(1)013.Price_logistic.py": [],
+}
 
-for script in scripts:
+# Одновременно работающих скриптов: все ходят в одну таблицу и один кабинет Ozon, квоты общие
+MAX_PARALLEL = 4
+
+# Если в выводе скрипта есть признаки исчерпанной квоты, новые скрипты не запускаются
+# QUOTA_COOLDOWN секунд (минутное окно квот Google Sheets); без таких признаков пауз нет
+QUOTA_MARKERS = ("[429]", "Too Many Requests", "RESOURCE_EXHAUSTED", "Quota exceeded")
+QUOTA_COOLDOWN = 60
+
+
+def run_script(script):
+    """
+    Запуск скрипта; вывод перехватывается и печатается целиком, чтобы параллельные скрипты не перемешивались.
+    Возвращает (успешно ли, вывод). Ctrl+C (KeyboardInterrupt) не перехватывается.
+    """
+    if not os.path.exists(script):
+        print(f"Файл не найден: {script}")
+        return False, ""
     print(f"Запуск: {script}")
-    
-    if os.path.exists(script):
-        try:
-            # Простой запуск без перехвата вывода (чтобы избежать проблем с кодировкой)
-            subprocess.run(['python', script], check=True)
-            print("Успешно завершен")
-        except:
-            print("Завершен с ошибкой (проблемы с кодировкой вывода)")
-    else:
-        print("Файл не найден")
-    
-    if script != scripts[-1]:
-        time.sleep(10)
-
-print("Все скрипты выполнены")
\ No newline at end of file
+    # Дочерний Python пишет в UTF-8 независимо от кодировки консоли
+    env = dict(os.environ, PYTHONIOENCODING="utf-8")
+    try:
+        result = subprocess.run(
+            [sys.executable, script], check=True, capture_output=True,
+            encoding='utf-8', errors='replace', env=env
+        )
+        output = result.stdout + result.stderr
+        print(f"Успешно завершен: {script}\n{output}")
+        return True, output
+    except subprocess.CalledProcessError as e:
+        output = (e.stdout or "") + (e.stderr or "")
+        print(f"Завершен с ошибкой (код {e.returncode}): {script}\n{output}")
+    except OSError as e:
+        output = ""
+        print(f"Не удалось запустить {script}: {e}")
+    return False, output
+
+
+pending = dict(scripts)
+finished = set()
+failed = []
+running = {}
+cooldown_until = 0.0
+
+with ThreadPoolExecutor(max_workers=MAX_PARALLEL) as executor:
+    while pending or running:
+        # Запускаем все скрипты, чьи зависимости уже отработали (успешно или нет — как и раньше, остальные идут дальше)
+        if time.monotonic() >= cooldown_until:
+            for script, deps in list(pending.items()):
+                if all(dep in finished for dep in deps):
+                    running[executor.submit(run_script, script)] = script
+                    del pending[script]
+
+        if not running:
+            time.sleep(max(0.0, cooldown_until - time.monotonic()))
+            continue
+
+        done, _ = wait(running, timeout=max(0.0, cooldown_until - time.monotonic()) or None, return_when=FIRST_COMPLETED)
+        for future in done:
+            script = running.pop(future)
+            finished.add(script)
+            ok, output = future.result()
+            if not ok:
+                failed.append(script)
+            if any(marker in output for marker in QUOTA_MARKERS):
+                print(f"Похоже, исчерпана квота API — пауза {QUOTA_COOLDOWN} с перед запуском следующих скриптов")
+                cooldown_until = time.monotonic() + QUOTA_COOLDOWN
+
+print("Все скрипты выполнены")
+if failed:
+    # Список для точечного перезапуска вместо повторного прогона всего набора
+    print("С ошибкой завершились:\n" + "\n".join(f"  {script}" for script in failed))